@@ -0,0 +1,708 @@
+import memory as mem
+import cpu
+import config
+
+# Audio Processing Unit
+#
+#  +------+----------------------------------------+
+#  | 4000 | Pulse 1    DDLC VVVV  duty, halt, vol  |
+#  | 4001 |            EPPP NSSS  sweep            |
+#  | 4002 |            TTTT TTTT  timer low        |
+#  | 4003 |            LLLL LTTT  length, timer hi |
+#  | 4004 | Pulse 2    same as pulse 1             |
+#  | 4008 | Triangle   CRRR RRRR  linear counter   |
+#  | 400A |            TTTT TTTT  timer low        |
+#  | 400B |            LLLL LTTT  length, timer hi |
+#  | 400C | Noise      --LC VVVV  halt, vol        |
+#  | 400E |            M--- PPPP  mode, period     |
+#  | 400F |            LLLL L---  length           |
+#  | 4010 | DMC        IL-- RRRR  irq, loop, rate  |
+#  | 4011 |            -DDD DDDD  output level     |
+#  | 4012 |            AAAA AAAA  sample address   |
+#  | 4013 |            LLLL LLLL  sample length    |
+#  | 4015 | Status     ---D NT21  channel enable   |
+#  | 4017 | Frame      MI-- ----  mode, irq        |
+#  +------+----------------------------------------+
+#
+# The APU is not stepped with the CPU. Register writes are logged with the
+# CPU cycle they happened at, and once per frame the channels are run with
+# NumPy, one segment at a time between two writes (or frame counter
+# steps), where every channel has a constant state.
+
+SAMPLE_RATE = 44100
+
+# NumPy takes longer to import than everything else at startup, it is only
+# imported by initialize() when samples are synthesized
+np = None
+
+# Channels
+PULSE1   = 0
+PULSE2   = 1
+TRIANGLE = 2
+NOISE    = 3
+DMC      = 4
+
+length_table = [
+   10, 254,  20,   2,  40,   4,  80,   6, 160,   8,  60,  10,  14,  12,  26,  14,
+   12,  16,  24,  18,  48,  20,  96,  22, 192,  24,  72,  26,  16,  28,  32,  30,
+]
+
+# Turned into NumPy arrays by load_numpy()
+duty_table = [
+  [0, 1, 0, 0, 0, 0, 0, 0], # 12.5%
+  [0, 1, 1, 0, 0, 0, 0, 0], # 25%
+  [0, 1, 1, 1, 1, 0, 0, 0], # 50%
+  [1, 0, 0, 1, 1, 1, 1, 1], # 25% negated
+]
+
+triangle_table = list(range(15, -1, -1)) + list(range(16))
+
+# Noise periods, DMC rates and frame counter steps are in CPU cycles and
+# differ on PAL, Dendy uses the NTSC ones. set_timing() picks the tables
+# of the region in config.
+NTSC_NOISE_PERIODS = [4, 8, 16, 32, 64, 96, 128, 160, 202, 254, 380, 508, 762, 1016, 2034, 4068]
+PAL_NOISE_PERIODS  = [4, 8, 14, 30, 60, 88, 118, 148, 188, 236, 354, 472, 708,  944, 1890, 3778]
+
+NTSC_DMC_RATES = [428, 380, 340, 320, 286, 254, 226, 214, 190, 160, 142, 128, 106, 84, 72, 54]
+PAL_DMC_RATES  = [398, 354, 316, 298, 276, 236, 210, 198, 176, 148, 132, 118,  98, 78, 66, 50]
+
+noise_periods = NTSC_NOISE_PERIODS
+dmc_rates     = NTSC_DMC_RATES
+
+# Frame counter steps, CPU cycles from the start of the sequence
+#
+# 4-step: quarter frame at every step, half frame at 2 and 4
+# 5-step: quarter frame at steps 1-3 and 5, half frame at 2 and 5
+NTSC_FOUR_STEP_SEQUENCE = [7457, 14913, 22371, 29829]
+NTSC_FIVE_STEP_SEQUENCE = [7457, 14913, 22371, 37281]
+PAL_FOUR_STEP_SEQUENCE  = [8313, 16627, 24939, 33253]
+PAL_FIVE_STEP_SEQUENCE  = [8313, 16627, 24939, 41565]
+HALF_FRAME_STEPS        = [1, 3]
+
+FOUR_STEP_SEQUENCE = NTSC_FOUR_STEP_SEQUENCE
+FIVE_STEP_SEQUENCE = NTSC_FIVE_STEP_SEQUENCE
+
+# Channel state, the first indexes are shared by the channels that have
+# the unit (pulses, triangle and noise for length counters, pulses and
+# noise for envelopes, where noise uses index 2)
+enabled = [False] * 5
+length  = [0] * 4
+halt    = [False] * 4
+
+envelope_start    = [False] * 3
+envelope_divider  = [0] * 3
+envelope_decay    = [0] * 3
+envelope_constant = [False] * 3
+envelope_volume   = [0] * 3
+
+pulse_duty    = [0, 0]
+pulse_period  = [0, 0]
+pulse_sweep   = [0, 0]
+sweep_divider = [0, 0]
+sweep_reload  = [False, False]
+
+triangle_period = 0
+linear_control  = False
+linear_reload   = 0
+linear_counter  = 0
+linear_flag     = False
+
+noise_mode   = 0
+noise_period = noise_periods[0]
+
+dmc_loop     = False
+dmc_rate     = dmc_rates[0]
+dmc_level    = 0
+dmc_address  = 0xC000
+dmc_length   = 1
+dmc_current  = 0xC000
+dmc_remaining = 0
+dmc_shift    = 0
+dmc_bits     = 0
+dmc_silence  = True
+dmc_timer    = 0
+
+# Sequencer positions of pulses, triangle and noise, in steps
+phase = [0.0] * 4
+
+frame_mode = 4
+frame_step = 0
+next_step  = FOUR_STEP_SEQUENCE[0]
+
+# Register writes (cycle, address, value) not applied yet
+writes = []
+
+# CPU cycle the channels are built up to
+position = 0
+
+# Turned off in headless mode, register state is kept but no deltas are
+# emitted
+synthesize = True
+
+# Noise shift register output, built on first use
+noise_sequences = None
+
+# Steps before the noise shift register repeats in mode 0 and 1, kept
+# apart from the sequences so headless runs advance the phase without
+# NumPy
+NOISE_LENGTHS = (32767, 93)
+
+def initialize():
+  global enabled, length, halt, envelope_start, envelope_divider, envelope_decay
+  global envelope_constant, envelope_volume, pulse_duty, pulse_period, pulse_sweep
+  global sweep_divider, sweep_reload, triangle_period, linear_control, linear_reload
+  global linear_counter, linear_flag, noise_mode, noise_period, dmc_loop, dmc_rate
+  global dmc_level, dmc_address, dmc_length, dmc_current, dmc_remaining, dmc_shift
+  global dmc_bits, dmc_silence, dmc_timer, phase, frame_mode, frame_step, next_step
+  global writes, position, levels, delta_cycles, delta_values, sample_origin, blip_tail
+  global integrator, cycle_rate
+
+  set_timing()
+  if synthesize:
+    load_numpy()
+
+  enabled = [False] * 5
+  length  = [0] * 4
+  halt    = [False] * 4
+
+  envelope_start    = [False] * 3
+  envelope_divider  = [0] * 3
+  envelope_decay    = [0] * 3
+  envelope_constant = [False] * 3
+  envelope_volume   = [0] * 3
+
+  pulse_duty    = [0, 0]
+  pulse_period  = [0, 0]
+  pulse_sweep   = [0, 0]
+  sweep_divider = [0, 0]
+  sweep_reload  = [False, False]
+
+  triangle_period = 0
+  linear_control  = False
+  linear_reload   = 0
+  linear_counter  = 0
+  linear_flag     = False
+
+  noise_mode   = 0
+  noise_period = noise_periods[0]
+
+  dmc_loop      = False
+  dmc_rate      = dmc_rates[0]
+  dmc_level     = 0
+  dmc_address   = 0xC000
+  dmc_length    = 1
+  dmc_current   = 0xC000
+  dmc_remaining = 0
+  dmc_shift     = 0
+  dmc_bits      = 0
+  dmc_silence   = True
+  dmc_timer     = 0
+
+  phase = [0.0] * 4
+
+  frame_mode = 4
+  frame_step = 0
+  next_step  = cpu.cycles + FOUR_STEP_SEQUENCE[0]
+
+  writes   = []
+  position = cpu.cycles
+
+  levels        = [0] * 5
+  delta_cycles  = []
+  delta_values  = []
+  sample_origin = float(cpu.cycles)
+  cycle_rate    = SAMPLE_RATE / config.cpu_clock
+  blip_tail     = np.zeros(KERNEL_WIDTH) if synthesize else None
+  integrator    = 0.0
+
+# Tables of the region in config
+def set_timing():
+  global noise_periods, dmc_rates, FOUR_STEP_SEQUENCE, FIVE_STEP_SEQUENCE
+
+  if config.region == config.PAL:
+    noise_periods, dmc_rates = PAL_NOISE_PERIODS, PAL_DMC_RATES
+    FOUR_STEP_SEQUENCE, FIVE_STEP_SEQUENCE = PAL_FOUR_STEP_SEQUENCE, PAL_FIVE_STEP_SEQUENCE
+  else:
+    noise_periods, dmc_rates = NTSC_NOISE_PERIODS, NTSC_DMC_RATES
+    FOUR_STEP_SEQUENCE, FIVE_STEP_SEQUENCE = NTSC_FOUR_STEP_SEQUENCE, NTSC_FIVE_STEP_SEQUENCE
+
+def load_numpy():
+  global np, duty_table, triangle_table
+
+  import numpy as np
+
+  duty_table = np.array(duty_table, dtype=np.int32)
+  triangle_table = np.array(triangle_table, dtype=np.int32)
+
+## Registers
+
+# CPU writes to 0x4000-0x4013, 0x4015 and 0x4017
+def write(address, value):
+  writes.append((cpu.cycles, address, value))
+
+# CPU reads of 0x4015, length counters and DMC status
+def read_status():
+  run_until(cpu.cycles)
+
+  status = 0
+  for channel in range(4):
+    if length[channel] > 0:
+      status |= 1 << channel
+  if dmc_remaining > 0:
+    status |= 0b0001_0000
+  return status
+
+def apply(address, value):
+  global triangle_period, linear_control, linear_reload, linear_flag
+  global noise_mode, noise_period, dmc_loop, dmc_rate, dmc_level, dmc_address, dmc_length
+  global dmc_remaining, frame_mode, frame_step, next_step
+
+  if address < 0x4008: # Pulse 1 and 2
+    pulse = (address >> 2) & 0x1
+    register = address & 0x3
+
+    if register == 0x0:
+      pulse_duty[pulse] = value >> 6
+      set_envelope(pulse, value)
+    elif register == 0x1:
+      pulse_sweep[pulse] = value
+      sweep_reload[pulse] = True
+    elif register == 0x2:
+      pulse_period[pulse] = (pulse_period[pulse] & 0x700) | value
+    else:
+      pulse_period[pulse] = (pulse_period[pulse] & 0xFF) | ((value & 0x7) << 8)
+      load_length(pulse, value)
+      envelope_start[pulse] = True
+      phase[pulse] = 0.0
+  elif address < 0x400C: # Triangle
+    if address == 0x4008:
+      linear_control = bool(value & 0x80)
+      halt[TRIANGLE] = linear_control
+      linear_reload = value & 0x7F
+    elif address == 0x400A:
+      triangle_period = (triangle_period & 0x700) | value
+    elif address == 0x400B:
+      triangle_period = (triangle_period & 0xFF) | ((value & 0x7) << 8)
+      load_length(TRIANGLE, value)
+      linear_flag = True
+  elif address < 0x4010: # Noise
+    if address == 0x400C:
+      set_envelope(2, value)
+    elif address == 0x400E:
+      noise_mode = value >> 7
+      noise_period = noise_periods[value & 0xF]
+    elif address == 0x400F:
+      load_length(NOISE, value)
+      envelope_start[2] = True
+  elif address == 0x4010: # DMC
+    dmc_loop = bool(value & 0x40)
+    dmc_rate = dmc_rates[value & 0xF]
+  elif address == 0x4011:
+    dmc_level = value & 0x7F
+  elif address == 0x4012:
+    dmc_address = 0xC000 + (value << 6)
+  elif address == 0x4013:
+    dmc_length = (value << 4) + 1
+  elif address == 0x4015: # Status
+    for channel in range(5):
+      enabled[channel] = bool(value & (1 << channel))
+    for channel in range(4):
+      if not enabled[channel]:
+        length[channel] = 0
+    if not enabled[DMC]:
+      dmc_remaining = 0
+    elif dmc_remaining == 0:
+      restart_dmc()
+  elif address == 0x4017: # Frame counter
+    frame_mode = 5 if value & 0x80 else 4
+    frame_step = 0
+    next_step = position + sequence()[0]
+    # The 5-step mode clocks every unit right away
+    if frame_mode == 5:
+      quarter_frame()
+      half_frame()
+
+def set_envelope(unit, value):
+  halt[unit if unit < 2 else NOISE] = bool(value & 0x20)
+  envelope_constant[unit] = bool(value & 0x10)
+  envelope_volume[unit] = value & 0xF
+
+def load_length(channel, value):
+  if enabled[channel]:
+    length[channel] = length_table[value >> 3]
+
+def restart_dmc():
+  global dmc_current, dmc_remaining
+
+  dmc_current = dmc_address
+  dmc_remaining = dmc_length
+
+## Frame Counter
+
+def sequence():
+  return FOUR_STEP_SEQUENCE if frame_mode == 4 else FIVE_STEP_SEQUENCE
+
+def clock_frame_counter():
+  global frame_step, next_step
+
+  steps = sequence()
+
+  quarter_frame()
+  if frame_step in HALF_FRAME_STEPS:
+    half_frame()
+
+  frame_step += 1
+  if frame_step == len(steps):
+    # The sequence is one cycle longer than its last step
+    next_step += 1 + steps[0]
+    frame_step = 0
+  else:
+    next_step += steps[frame_step] - steps[frame_step - 1]
+
+# Envelopes and triangle linear counter
+def quarter_frame():
+  global linear_counter, linear_flag
+
+  for unit in range(3):
+    if envelope_start[unit]:
+      envelope_start[unit] = False
+      envelope_decay[unit] = 15
+      envelope_divider[unit] = envelope_volume[unit]
+    elif envelope_divider[unit] == 0:
+      envelope_divider[unit] = envelope_volume[unit]
+      if envelope_decay[unit] > 0:
+        envelope_decay[unit] -= 1
+      elif halt[unit if unit < 2 else NOISE]:
+        envelope_decay[unit] = 15
+    else:
+      envelope_divider[unit] -= 1
+
+  if linear_flag:
+    linear_counter = linear_reload
+  elif linear_counter > 0:
+    linear_counter -= 1
+  if not linear_control:
+    linear_flag = False
+
+# Length counters and sweeps
+def half_frame():
+  for channel in range(4):
+    if length[channel] > 0 and not halt[channel]:
+      length[channel] -= 1
+
+  for pulse in range(2):
+    sweep = pulse_sweep[pulse]
+    target = sweep_target(pulse)
+    if sweep_divider[pulse] == 0 and sweep & 0x80 and sweep & 0x7 and not sweep_muted(pulse, target):
+      pulse_period[pulse] = target
+    if sweep_divider[pulse] == 0 or sweep_reload[pulse]:
+      sweep_divider[pulse] = (sweep >> 4) & 0x7
+      sweep_reload[pulse] = False
+    else:
+      sweep_divider[pulse] -= 1
+
+#  EPPP NSSS
+#  E - Enabled, P - Divider period, N - Negate, S - Shift
+def sweep_target(pulse):
+  period = pulse_period[pulse]
+  change = period >> (pulse_sweep[pulse] & 0x7)
+  if pulse_sweep[pulse] & 0x8:
+    # Pulse 1 negates with one's complement
+    return period - change - (1 if pulse == PULSE1 else 0)
+  return period + change
+
+def sweep_muted(pulse, target):
+  return pulse_period[pulse] < 8 or target > 0x7FF
+
+def envelope(unit):
+  return envelope_volume[unit] if envelope_constant[unit] else envelope_decay[unit]
+
+## Synthesis
+#
+# Channels are not sampled. Each channel emits the change of its output
+# (a delta) at the CPU cycle it happens, and end_frame() turns all the
+# deltas of a frame into samples at once through a band-limited step
+# buffer (blip buffer):
+#
+#   1. every delta adds a windowed sinc impulse, picked from KERNEL_PHASES
+#      pre-computed sub-sample positions, into a difference buffer
+#   2. the running sum of the difference buffer is the band-limited output
+#
+# so the cost depends on the number of output samples and transitions,
+# not on the 1.79MHz CPU clock.
+
+# Linear approximation of the mixer, so each channel's deltas can be added
+# on their own
+PULSE_WEIGHT    = 0.00752
+TRIANGLE_WEIGHT = 0.00851
+NOISE_WEIGHT    = 0.00494
+DMC_WEIGHT      = 0.00335
+
+KERNEL_PHASES = 32
+KERNEL_WIDTH  = 16
+
+# Output level of each channel after the last emitted delta
+levels = [0] * 5
+
+# Deltas of the frame, CPU cycle and amplitude
+delta_cycles = []
+delta_values = []
+
+# CPU cycle of the first sample in blip_tail, output samples per CPU cycle
+sample_origin = 0.0
+cycle_rate    = SAMPLE_RATE / config.cpu_clock
+
+# End of the difference buffer not output yet, and the running sum
+blip_tail  = None
+integrator = 0.0
+
+# Band-limited impulses, one row per sub-sample phase, built on first use
+kernel = None
+
+# Applies the logged writes and builds the samples up to a CPU cycle
+def run_until(cycle):
+  global writes
+
+  for write_cycle, address, value in writes:
+    advance(write_cycle)
+    apply(address, value)
+  writes = []
+
+  advance(cycle)
+
+def advance(cycle):
+  global position
+
+  while next_step <= cycle:
+    build(position, next_step)
+    position = next_step
+    clock_frame_counter()
+
+  build(position, cycle)
+  position = cycle
+
+# Emits the deltas of CPU cycles [start, end), the state is constant
+def build(start, end):
+  if end <= start:
+    return
+
+  if synthesize:
+    emit(PULSE1,   PULSE_WEIGHT,    *pulse_steps(PULSE1, start, end))
+    emit(PULSE2,   PULSE_WEIGHT,    *pulse_steps(PULSE2, start, end))
+    emit(TRIANGLE, TRIANGLE_WEIGHT, *triangle_steps(start, end))
+    emit(NOISE,    NOISE_WEIGHT,    *noise_steps(start, end))
+    cycles, outputs = dmc_steps(start, end)
+    emit(DMC,      DMC_WEIGHT,      np.array(cycles), np.array(outputs, dtype=np.int32))
+  else:
+    dmc_steps(start, end)
+
+  advance_phases(end - start)
+
+# Turns the output levels of a channel at some CPU cycles into deltas
+def emit(channel, weight, cycles, outputs):
+  previous = np.empty(len(outputs), dtype=np.int32)
+  previous[0] = levels[channel]
+  previous[1:] = outputs[:-1]
+
+  deltas = outputs - previous
+  changed = deltas != 0
+  if changed.any():
+    delta_cycles.append(cycles[changed])
+    delta_values.append(deltas[changed] * weight)
+
+  levels[channel] = int(outputs[-1])
+
+# Output at start and after each sequencer step of the segment, for a
+# sequencer moving one step every period CPU cycles from phase steps
+def sequencer_steps(position, period, start, end):
+  first = int(position) + 1
+  count = max(0, int(np.ceil((end - start) / period - (first - position))))
+
+  steps = np.arange(int(position), first + count)
+  cycles = start + (steps - position) * period
+  cycles[0] = start
+  return cycles, steps
+
+def pulse_steps(pulse, start, end):
+  if not length[pulse] or sweep_muted(pulse, sweep_target(pulse)):
+    return np.array([start]), np.zeros(1, dtype=np.int32)
+
+  # The sequencer steps once every 2 * (period + 1) CPU cycles
+  cycles, steps = sequencer_steps(phase[pulse], 2 * (pulse_period[pulse] + 1), start, end)
+  return cycles, duty_table[pulse_duty[pulse]][steps & 0x7] * envelope(pulse)
+
+def triangle_steps(start, end):
+  # Silenced by the counters the sequencer just stops, the output holds
+  if not length[TRIANGLE] or not linear_counter or triangle_period < 2:
+    return np.array([start]), triangle_table[[int(phase[TRIANGLE]) & 0x1F]]
+
+  cycles, steps = sequencer_steps(phase[TRIANGLE], triangle_period + 1, start, end)
+  return cycles, triangle_table[steps & 0x1F]
+
+def noise_steps(start, end):
+  if not length[NOISE]:
+    return np.array([start]), np.zeros(1, dtype=np.int32)
+
+  output = noise_sequence()
+  cycles, steps = sequencer_steps(phase[NOISE], noise_period, start, end)
+  return cycles, output[steps % len(output)] * envelope(2)
+
+def dmc_steps(start, end):
+  global dmc_timer
+
+  # Output level changes of the segment
+  cycles = [start]
+  outputs = [dmc_level]
+
+  cycle = dmc_timer
+  while cycle < end - start:
+    if clock_dmc():
+      cycles.append(start + cycle)
+      outputs.append(dmc_level)
+    cycle += dmc_rate
+  dmc_timer = cycle - (end - start)
+
+  return cycles, outputs
+
+# Clocks the DMC output unit, returns True if the level changed
+def clock_dmc():
+  global dmc_shift, dmc_bits, dmc_silence, dmc_level, dmc_current, dmc_remaining
+
+  changed = False
+  if not dmc_silence:
+    if dmc_shift & 0x1:
+      if dmc_level <= 125:
+        dmc_level += 2
+        changed = True
+    elif dmc_level >= 2:
+      dmc_level -= 2
+      changed = True
+    dmc_shift >>= 1
+
+  dmc_bits -= 1
+  if dmc_bits <= 0:
+    dmc_bits = 8
+    if dmc_remaining > 0:
+      dmc_shift = mem.memory[dmc_current]
+      dmc_current = 0x8000 if dmc_current == 0xFFFF else dmc_current + 1
+      dmc_remaining -= 1
+      dmc_silence = False
+      if dmc_remaining == 0 and dmc_loop:
+        restart_dmc()
+    else:
+      dmc_silence = True
+
+  return changed
+
+def advance_phases(cycles):
+  for pulse in range(2):
+    if length[pulse]:
+      phase[pulse] = (phase[pulse] + cycles / (2 * (pulse_period[pulse] + 1))) % 8
+
+  if length[TRIANGLE] and linear_counter and triangle_period >= 2:
+    phase[TRIANGLE] = (phase[TRIANGLE] + cycles / (triangle_period + 1)) % 32
+
+  if length[NOISE]:
+    phase[NOISE] = (phase[NOISE] + cycles / noise_period) % NOISE_LENGTHS[noise_mode]
+
+# Output of the 15-bit noise shift register for each step, mode 0 feeds
+# back bit 1, mode 1 bit 6
+def noise_sequence():
+  global noise_sequences
+
+  if noise_sequences is None:
+    noise_sequences = []
+    for tap in (1, 6):
+      register = 1
+      output = []
+      while True:
+        output.append(0 if register & 0x1 else 1)
+        feedback = (register ^ (register >> tap)) & 0x1
+        register = (register >> 1) | (feedback << 14)
+        if register == 1:
+          break
+      noise_sequences.append(np.array(output, dtype=np.int32))
+
+  return noise_sequences[noise_mode]
+
+# Windowed sinc impulses normalised to a sum of 1, so the running sum of
+# an impulse is a step of exactly the delta
+def make_kernel():
+  half = KERNEL_WIDTH // 2
+  offsets = np.arange(KERNEL_WIDTH) - (half - 1)
+  window = np.blackman(KERNEL_WIDTH + 1)[:KERNEL_WIDTH]
+
+  rows = []
+  for phase in range(KERNEL_PHASES):
+    x = offsets - phase / KERNEL_PHASES
+    impulse = np.sinc(0.9 * x) * window
+    rows.append(impulse / impulse.sum())
+  return np.array(rows)
+
+# Output continues from the current CPU cycle, after a save state is
+# loaded the deltas of the abandoned timeline are dropped. The running sum
+# (integrator and blip_tail) still ends at the levels of that timeline,
+# one step to the mix of the loaded levels brings it back, or the
+# difference would stay as a DC offset and add up over loads.
+def restart_output():
+  global delta_cycles, delta_values, sample_origin
+
+  delta_cycles = []
+  delta_values = []
+  sample_origin = float(cpu.cycles)
+
+  if synthesize and blip_tail is not None:
+    step = mix(levels) - integrator - blip_tail.sum()
+    if step:
+      delta_cycles.append(np.array([sample_origin]))
+      delta_values.append(np.array([step]))
+
+# Output of the linear mixer for channel levels
+def mix(channel_levels):
+  pulse1, pulse2, triangle, noise, dmc = channel_levels
+  return ((pulse1 + pulse2) * PULSE_WEIGHT + triangle * TRIANGLE_WEIGHT
+    + noise * NOISE_WEIGHT + dmc * DMC_WEIGHT)
+
+# Builds the samples up to the current CPU cycle and returns them as
+# 16-bit signed samples, an empty list when nothing is synthesized
+def end_frame():
+  global delta_cycles, delta_values, sample_origin, blip_tail, integrator, kernel
+
+  run_until(cpu.cycles)
+
+  if not synthesize:
+    delta_cycles = []
+    delta_values = []
+    sample_origin = float(cpu.cycles)
+    return []
+
+  if kernel is None:
+    kernel = make_kernel()
+
+  # Samples whose impulses are complete, a later delta can only start
+  # at or after the current cycle
+  count = int((cpu.cycles - sample_origin) * cycle_rate)
+
+  buffer = np.zeros(count + KERNEL_WIDTH + 1)
+  buffer[:KERNEL_WIDTH] += blip_tail
+
+  if delta_cycles:
+    times = (np.concatenate(delta_cycles) - sample_origin) * cycle_rate
+    values = np.concatenate(delta_values)
+
+    index = times.astype(np.int64)
+    phases = ((times - index) * KERNEL_PHASES).astype(np.int64)
+    positions = index[:, None] + np.arange(KERNEL_WIDTH)
+    buffer += np.bincount(positions.ravel(), (kernel[phases] * values[:, None]).ravel(), len(buffer))[:len(buffer)]
+
+  output = integrator + np.cumsum(buffer[:count])
+  if count:
+    integrator = output[-1]
+
+  blip_tail = buffer[count:count + KERNEL_WIDTH].copy()
+  sample_origin += count / cycle_rate
+  delta_cycles = []
+  delta_values = []
+
+  # Loud mixes can go past full scale, they are clipped, not wrapped
+  return (np.clip(output, -1.0, 1.0) * 32767).astype(np.int16)
@@ -0,0 +1,114 @@
+import sys
+
+# Audio Output
+#
+# The APU writes each frame of samples into a ring buffer, the audio device
+# callback (on the SDL audio thread) reads from it. There is one writer and
+# one reader, each only moves its own index, so no lock is needed.
+#
+#          read_index            write_index
+#              |                      |
+#  +-----------v----------------------v-----------+
+#  |           |  samples to be played |          |
+#  +-----------+----------------------+-----------+
+#
+# The indexes only grow, the position in the buffer is index % capacity.
+
+# pygame and NumPy are only imported when the device is opened
+pygame = None
+np     = None
+device = None
+
+sample_rate = 44100
+
+ring = None
+capacity    = 0
+write_index = 0
+read_index  = 0
+
+# Samples dropped because the buffer was full, and samples of silence
+# played because it was empty
+overruns  = 0
+underruns = 0
+
+# Opens the first output device, returns False when there is none
+def initialize(rate=44100, buffer_seconds=0.25, chunk=512):
+  global pygame, np, device, sample_rate, ring, capacity, write_index, read_index
+
+  import numpy as np
+
+  sample_rate = rate
+  capacity = int(rate * buffer_seconds)
+  ring = np.zeros(capacity, dtype=np.int16)
+  write_index = 0
+  read_index  = 0
+
+  # pygame.mixer has no streaming callback, the device is opened through
+  # the SDL2 audio module that comes with it. Only the audio subsystem is
+  # started, pygame.mixer.init() would take the device for itself.
+  import pygame
+  import pygame._sdl2.audio as sdl_audio
+  import pygame._sdl2.sdl2 as sdl
+
+  # Without an output device (or audio driver) the emulator runs silent,
+  # write() still takes the samples and nothing plays them
+  try:
+    sdl.init_subsystem(sdl.INIT_AUDIO)
+    names = sdl_audio.get_audio_device_names(False)
+  except sdl.error:
+    names = []
+  if not names:
+    print('no audio output device, running without sound', file=sys.stderr)
+    return False
+
+  # First output device, mono, 16-bit signed samples
+  device = sdl_audio.AudioDevice(names[0], False, rate, sdl_audio.AUDIO_S16, 1, chunk, 0, fill_stream)
+  device.pause(0)
+  return True
+
+# Samples waiting to be played
+def fill():
+  return write_index - read_index
+
+# Called by the emulation thread once per frame
+def write(samples):
+  global write_index, overruns
+
+  free = capacity - (write_index - read_index)
+  if len(samples) > free:
+    overruns += len(samples) - free
+    samples = samples[:free]
+
+  start = write_index % capacity
+  count = len(samples)
+  first = min(count, capacity - start)
+  ring[start:start + first] = samples[:first]
+  ring[:count - first] = samples[first:]
+
+  # Published after the samples are in place
+  write_index += count
+
+# Called by the audio thread when the device needs samples
+def fill_stream(audio_device, stream):
+  global read_index, underruns
+
+  out = np.frombuffer(stream, dtype=np.int16)
+  count = min(len(out), write_index - read_index)
+
+  start = read_index % capacity
+  first = min(count, capacity - start)
+  out[:first] = ring[start:start + first]
+  out[first:count] = ring[:count - first]
+
+  if count < len(out):
+    out[count:] = 0
+    underruns += len(out) - count
+
+  read_index += count
+
+def close():
+  global device
+
+  if device is not None:
+    device.close()
+    device = None
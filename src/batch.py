@@ -0,0 +1,215 @@
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+
+# Batch Environment
+#
+# Steps many headless emulators at once, for training agents. Instances
+# are spread over a pool of worker processes, each running its share one
+# after the other: the machine is module globals, so a worker switches
+# between its instances with savestate.clone() and restore(). Those only
+# copy the dirty pages when restoring the clone taken last, so a worker
+# with several instances copies the whole 64KB address space on each
+# switch; one instance per worker avoids that.
+#
+#   BatchEmulator                     worker 0          worker 1
+#  +--------------+  step / reset    +-----------+     +-----------+
+#  | step()       | ---------------> | 0 1 2 3   |     | 4 5 6 7   |
+#  | reset()      | <--------------- |           |     |           |
+#  +--------------+  'ok'            +-----------+     +-----------+
+#          |                               |                 |
+#          v                               v                 v
+#  +---------------------------------------------------------------+
+#  | Shared memory  actions (n, 2) | frames (n, 240, 256) | ram (n, 2048) |
+#  +---------------------------------------------------------------+
+#
+# Only the command goes through the pipe, actions and observations are
+# in one shared memory block. step() and reset() return NumPy arrays on
+# that block, they are overwritten by the next call (copy to keep them).
+#
+# Every instance starts from the same start state, the machine after
+# power-on (and start_frames frames with no buttons pressed, or a save
+# state). It is cloned once in every worker and reset() restores it.
+#
+#   env = BatchEmulator(64, 'game.nes')
+#   frames, ram = env.reset()
+#   frames, ram = env.step(actions)   # actions: (64,) or (64, 2) button bytes
+#   env.close()
+FRAME_SIZE = 256 * 240
+RAM_SIZE   = 0x800
+PORTS      = 2
+
+class BatchEmulator:
+  def __init__(self, n, rom, processes=None, start_frames=0, start_state=None, region=None):
+    import numpy as np
+
+    if n < 1:
+      raise ValueError('at least one instance is needed')
+    processes = max(1, min(n, processes or os.cpu_count() or 1))
+
+    self.n = n
+    self.memory = shared_memory.SharedMemory(create=True, size=n * (PORTS + FRAME_SIZE + RAM_SIZE))
+    buffer = self.memory.buf
+    self.actions = np.ndarray((n, PORTS), np.uint8, buffer, 0)
+    self.frames = np.ndarray((n, 240, 256), np.uint8, buffer, n * PORTS)
+    self.ram = np.ndarray((n, RAM_SIZE), np.uint8, buffer, n * (PORTS + FRAME_SIZE))
+    self.actions[:] = 0
+
+    # Contiguous ranges of instances, as even as they can be
+    self.workers = []
+    try:
+      for index in range(processes):
+        first = n * index // processes
+        last = n * (index + 1) // processes
+        connection, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+          target=work, name='batch-%d' % index,
+          args=(child, self.memory.name, n, first, last, rom, start_frames, start_state, region))
+        process.start()
+        child.close()
+        self.workers.append((process, connection))
+
+      self.command('start')
+    except BaseException:
+      self.close()
+      raise
+
+  # Runs one frame of every instance with actions, the buttons of port 0
+  # or of both ports, one byte per instance
+  def step(self, actions):
+    if getattr(actions, 'ndim', 1) == 1 and len(actions) == self.n:
+      self.actions[:, 0] = actions
+      self.actions[:, 1] = 0
+    else:
+      self.actions[:] = actions
+    self.command('step')
+    return self.frames, self.ram
+
+  # Puts the instances given (all of them by default) back to the start
+  # state, a sequence of indexes or a boolean mask
+  def reset(self, instances=None):
+    import numpy as np
+
+    if instances is None:
+      selected = np.ones(self.n, np.bool_)
+    else:
+      selected = np.zeros(self.n, np.bool_)
+      selected[instances] = True
+    self.command('reset', selected.tobytes())
+    return self.frames, self.ram
+
+  # Sends to every worker, then waits for them all, they run in parallel
+  def command(self, *message):
+    for process, connection in self.workers:
+      connection.send(message)
+
+    errors = []
+    for process, connection in self.workers:
+      try:
+        reply = connection.recv()
+      except EOFError:
+        reply = '%s exited' % process.name
+      if reply != 'ok':
+        errors.append(reply)
+    if errors:
+      raise ValueError('; '.join(errors))
+
+  def close(self):
+    for process, connection in self.workers:
+      try:
+        connection.send(('close',))
+      except OSError:
+        pass
+    for process, connection in self.workers:
+      process.join(5)
+      if process.is_alive():
+        process.terminate()
+      connection.close()
+    self.workers = []
+
+    if self.memory is not None:
+      # The arrays are views on the block, it can not be closed under them
+      self.actions = self.frames = self.ram = None
+      self.memory.close()
+      self.memory.unlink()
+      self.memory = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exception):
+    self.close()
+
+## Workers
+
+# Runs instances first to last - 1 until told to close
+def work(connection, name, n, first, last, rom, start_frames, start_state, region):
+  import main
+  import memory as mem
+  import ppu
+  import savestate
+  import input as controller
+
+  memory = shared_memory.SharedMemory(name)
+  buffer = memory.buf
+  actions = buffer[:n * PORTS]
+  frames = buffer[n * PORTS:n * (PORTS + FRAME_SIZE)]
+  ram = buffer[n * (PORTS + FRAME_SIZE):]
+
+  # With one instance the machine never has to be switched
+  count = last - first
+  start = None
+  states = []
+
+  # Restoring a state does not bring back the frame shown with it
+  start_frame = b''
+
+  def observe(index, frame):
+    frames[index * FRAME_SIZE:(index + 1) * FRAME_SIZE] = frame
+    ram[index * RAM_SIZE:(index + 1) * RAM_SIZE] = mem.memory[:RAM_SIZE]
+
+  try:
+    while True:
+      message = connection.recv()
+      try:
+        if message[0] == 'start':
+          main.initialize(rom, headless_mode=True, region=region, battery_save=False)
+          if start_state:
+            savestate.load_file(start_state)
+          for _ in range(start_frames):
+            main.next_frame()
+          start = savestate.clone()
+          start_frame = bytes(ppu.frame)
+          states = [start] * count
+          for index in range(first, last):
+            observe(index, start_frame)
+
+        elif message[0] == 'step':
+          for index in range(first, last):
+            if count > 1:
+              savestate.restore(states[index - first])
+            controller.ports[0] = actions[index * PORTS]
+            controller.ports[1] = actions[index * PORTS + 1]
+            main.next_frame()
+            observe(index, ppu.frame)
+            if count > 1:
+              states[index - first] = savestate.clone()
+
+        elif message[0] == 'reset':
+          selected = message[1]
+          for index in range(first, last):
+            if selected[index]:
+              savestate.restore(start)
+              states[index - first] = start
+              observe(index, start_frame)
+
+        elif message[0] == 'close':
+          break
+
+        connection.send('ok')
+      except Exception as error:
+        connection.send('%s: %s' % (multiprocessing.current_process().name, error))
+  finally:
+    del actions, frames, ram, buffer
+    memory.close()
+    connection.close()
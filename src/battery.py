@@ -0,0 +1,83 @@
+import os
+import mmap
+import time
+import memory as mem
+
+# Battery-Backed PRG-RAM
+#
+# Cartridges with a battery (header byte 6, bit 1) keep the 8KB of
+# PRG-RAM at 0x6000-0x7FFF when switched off. It is kept in a .sav file
+# next to the ROM, mapped into memory: mem.write() stores into the map as
+# well as into mem.memory, so a write only touches the page cache and
+# survives the emulator crashing. Writing the pages to disk (msync) is
+# left to flush(), at most every FLUSH_INTERVAL seconds while the RAM is
+# dirty, and at exit.
+SIZE = 0x2000
+
+FLUSH_INTERVAL = 5.0
+
+path = None
+save = None
+mapping = None
+
+# perf_counter() time of the last flush, and flushes done
+last_flush = 0.0
+flushes    = 0
+
+def save_path(rom):
+  return os.path.splitext(rom)[0] + '.sav'
+
+def initialize(rom):
+  global path, save, mapping, last_flush, flushes
+
+  close()
+  path = save_path(rom)
+
+  # A new save starts zeroed, a short one (other emulator) is padded
+  if not os.path.exists(path):
+    open(path, 'wb').close()
+  save = open(path, 'r+b')
+  if os.fstat(save.fileno()).st_size < SIZE:
+    save.truncate(SIZE)
+
+  mapping = mmap.mmap(save.fileno(), SIZE)
+  mem.memory[0x6000:0x8000] = mapping[:SIZE]
+  mem.prg_ram = mapping
+  mem.prg_ram_dirty = False
+
+  last_flush = time.perf_counter()
+  flushes = 0
+
+# Called once a frame
+def update():
+  if mem.prg_ram_dirty and time.perf_counter() - last_flush >= FLUSH_INTERVAL:
+    flush()
+
+def flush():
+  global last_flush, flushes
+
+  if mapping is None:
+    return
+
+  mapping.flush()
+  mem.prg_ram_dirty = False
+  last_flush = time.perf_counter()
+  flushes += 1
+
+# After a save state is loaded the RAM has to match mem.memory again
+def sync():
+  if mapping is not None and mapping[:SIZE] != mem.memory[0x6000:0x8000]:
+    mapping[:SIZE] = mem.memory[0x6000:0x8000]
+    mem.prg_ram_dirty = True
+
+def close():
+  global path, save, mapping
+
+  if mapping is None:
+    return
+
+  flush()
+  mem.prg_ram = None
+  mapping.close()
+  save.close()
+  path = save = mapping = None
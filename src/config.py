@@ -1 +1,57 @@
 prg_start = 0x0
+
+# TV Systems
+#
+# Read from the ROM header by the loader, or forced with set_region().
+# Everything that depends on the region is chosen here once, the CPU, PPU
+# and APU loops never look at the region.
+#
+#  +-------+-----------+------------+-----------+--------+----------------+
+#  |       | CPU clock | Dots/cycle | Scanlines | VBlank | Odd frame skip |
+#  +-------+-----------+------------+-----------+--------+----------------+
+#  | NTSC  | 1789773   | 3          | 262       | 241    | yes            |
+#  | PAL   | 1662607   | 3.2        | 312       | 241    | no             |
+#  | Dendy | 1773448   | 3          | 312       | 291    | no             |
+#  +-------+-----------+------------+-----------+--------+----------------+
+#
+NTSC  = 0
+PAL   = 1
+DENDY = 2
+
+region_names = {'ntsc': NTSC, 'pal': PAL, 'dendy': DENDY}
+
+# CPU clock, PPU dots per CPU cycle (as dots, cycles), scanlines, vertical
+# blank scanline and odd frame skip
+regions = {
+  NTSC:  (1789773, (3, 1),  262, 241, True),
+  PAL:   (1662607, (16, 5), 312, 241, False),
+  DENDY: (1773448, (3, 1),  312, 291, False),
+}
+
+DOTS_PER_SCANLINE = 341
+
+region = NTSC
+
+# Frame timing
+# CPU clock in Hz and CPU cycles per frame
+cpu_clock       = 1789773
+cycle_dots      = 3
+cycle_divisor   = 1
+scanlines       = 262
+vblank_scanline = 241
+odd_frame_skip  = True
+frame_cycles    = 29780.5
+frame_rate      = cpu_clock / frame_cycles
+
+def set_region(tv_system):
+  global region, cpu_clock, cycle_dots, cycle_divisor, scanlines, vblank_scanline
+  global odd_frame_skip, frame_cycles, frame_rate
+
+  region = tv_system
+  cpu_clock, (cycle_dots, cycle_divisor), scanlines, vblank_scanline, odd_frame_skip = regions[region]
+
+  # NTSC odd frames are one dot shorter with rendering on, half a dot on
+  # average
+  frame_dots   = DOTS_PER_SCANLINE * scanlines - (0.5 if odd_frame_skip else 0)
+  frame_cycles = frame_dots * cycle_divisor / cycle_dots
+  frame_rate   = cpu_clock / frame_cycles
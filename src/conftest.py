@@ -0,0 +1,120 @@
+import pytest
+
+# Test ROM
+#
+# A 16KB NROM program that turns on rendering, sound and the vblank NMI.
+# Every NMI counts frames at 0x00 and 0x0200, sets the pulse period from
+# the count and selects the background pattern table with the A button
+# of port 0 (PPUCTRL bit 4), so different input gives different states
+# and frames. The two pattern tables draw different tiles. The nametable
+# fill is unrolled, the program only uses the simplest instructions.
+PROGRAM = [
+  ('reset',),
+  0x78,                          # SEI
+  0xD8,                          # CLD
+  0xA2, 0xFF,                    # LDX #$FF
+  0x9A,                          # TXS
+
+  # Nametable 0, tiles 0-7 over and over
+  0xA9, 0x20, 0x8D, 0x06, 0x20,  # LDA #$20, STA $2006
+  0xA9, 0x00, 0x8D, 0x06, 0x20,  # LDA #$00, STA $2006
+] + [
+  byte for tile in range(256) for byte in (0xA9, tile & 0x7, 0x8D, 0x07, 0x20)
+] + [
+
+  # Background palette
+  0xA9, 0x3F, 0x8D, 0x06, 0x20,  # LDA #$3F, STA $2006
+  0xA9, 0x00, 0x8D, 0x06, 0x20,  # LDA #$00, STA $2006
+  0xA9, 0x0F, 0x8D, 0x07, 0x20,
+  0xA9, 0x16, 0x8D, 0x07, 0x20,
+  0xA9, 0x2A, 0x8D, 0x07, 0x20,
+  0xA9, 0x12, 0x8D, 0x07, 0x20,
+
+  # Pulse 1, constant volume 15, enabled before its length is loaded
+  0xA9, 0x01, 0x8D, 0x15, 0x40,  # LDA #$01, STA $4015
+  0xA9, 0xBF, 0x8D, 0x00, 0x40,  # LDA #$BF, STA $4000
+  0xA9, 0x80, 0x8D, 0x02, 0x40,  # LDA #$80, STA $4002
+  0xA9, 0x00, 0x8D, 0x03, 0x40,  # LDA #$00, STA $4003
+
+  0xA9, 0x00, 0x8D, 0x05, 0x20, 0x8D, 0x05, 0x20,  # scroll 0, 0
+  0xA9, 0x80, 0x8D, 0x00, 0x20,  # LDA #$80, STA $2000 (NMI)
+  0xA9, 0x0A, 0x8D, 0x01, 0x20,  # LDA #$0A, STA $2001 (background)
+  ('loop',),
+  0x4C, ('absolute', 'loop'),    # JMP loop
+
+  ('nmi',),
+  0xE6, 0x00,                    # INC $00
+  0xEE, 0x00, 0x02,              # INC $0200
+  0xA5, 0x00, 0x8D, 0x02, 0x40,  # LDA $00, STA $4002
+  0xA9, 0x01, 0x8D, 0x16, 0x40,  # LDA #$01, STA $4016
+  0xA9, 0x00, 0x8D, 0x16, 0x40,  # LDA #$00, STA $4016
+  0xAD, 0x16, 0x40,              # LDA $4016
+  0x29, 0x01,                    # AND #$01
+  0x8D, 0x01, 0x00,              # STA $0001
+  0x0A, 0x0A, 0x0A, 0x0A,        # ASL x4
+  0x09, 0x80,                    # ORA #$80
+  0x8D, 0x00, 0x20,              # STA $2000
+  0xA9, 0x00, 0x8D, 0x05, 0x20, 0x8D, 0x05, 0x20,  # scroll 0, 0
+  0x40,                          # RTI
+]
+
+PRG_START = 0xC000
+
+# Items are opcode and operand bytes, (label,) to mark an address and
+# ('absolute', label) for its two bytes
+def assemble(program):
+  labels = {}
+  address = PRG_START
+  for item in program:
+    if isinstance(item, int):
+      address += 1
+    elif item[0] == 'absolute':
+      address += 2
+    else:
+      labels[item[0]] = address
+
+  code = bytearray()
+  for item in program:
+    if isinstance(item, int):
+      code.append(item)
+    elif item[0] == 'absolute':
+      code += labels[item[1]].to_bytes(2, 'little')
+  return code, labels
+
+def build_rom():
+  code, labels = assemble(PROGRAM)
+
+  prg = bytearray(0x4000)
+  prg[:len(code)] = code
+  prg[0x3FFA:0x4000] = b''.join(labels[name].to_bytes(2, 'little') for name in ('nmi', 'reset', 'reset'))
+
+  # Table 0 draws the low plane from the left half of each tile, table 1
+  # from the right half, the high plane is the tile number
+  chr_rom = bytearray(0x2000)
+  for table, low in ((0, 0xF0), (1, 0x0F)):
+    for tile in range(8):
+      start = table * 0x1000 + tile * 16
+      chr_rom[start:start + 8] = bytes([low]) * 8
+      chr_rom[start + 8:start + 16] = bytes([tile * 0x21 & 0xFF]) * 8
+
+  return b'NES\x1a\x01\x01' + bytes(10) + prg + chr_rom
+
+@pytest.fixture
+def rom(tmp_path):
+  path = tmp_path / 'test.nes'
+  path.write_bytes(build_rom())
+  return str(path)
+
+# The machine powered on with the test ROM, headless
+@pytest.fixture
+def machine(rom):
+  import main
+  import rewind
+  import runahead
+  import movie
+
+  rewind.enabled = False
+  runahead.initialize(0)
+  movie.mode = None
+  main.initialize(rom, headless_mode=True)
+  return main
@@ -38,8 +38,41 @@ P = 0
 # The NES opcodes range from 0x00 to 0xFF
 opcode = 0
 
+# CPU cycles executed since power up
+cycles = 0
+
+# Set by the PPU when the vertical blank starts with NMI enabled
+nmi_pending = False
+
+# CPU cycle the current frame ends at, frames are config.frame_cycles long
+# and the fraction is carried over (see main.run_frame())
+frame_end = 0.0
+
+# Base number of cycles of each opcode, page boundary crossings and taken
+# branches are not counted
+#
+#     0 1 2 3 4 5 6 7 8 9 A B C D E F
+cycle_table = [
+    7,6,2,8,3,3,5,5,3,2,2,2,4,4,6,6, # 0x00
+    2,5,2,8,4,4,6,6,2,4,2,7,4,4,7,7, # 0x10
+    6,6,2,8,3,3,5,5,4,2,2,2,4,4,6,6, # 0x20
+    2,5,2,8,4,4,6,6,2,4,2,7,4,4,7,7, # 0x30
+    6,6,2,8,3,3,5,5,3,2,2,2,3,4,6,6, # 0x40
+    2,5,2,8,4,4,6,6,2,4,2,7,4,4,7,7, # 0x50
+    6,6,2,8,3,3,5,5,4,2,2,2,5,4,6,6, # 0x60
+    2,5,2,8,4,4,6,6,2,4,2,7,4,4,7,7, # 0x70
+    2,6,2,6,3,3,3,3,2,2,2,2,4,4,4,4, # 0x80
+    2,6,2,6,4,4,4,4,2,5,2,5,5,5,5,5, # 0x90
+    2,6,2,6,3,3,3,3,2,2,2,2,4,4,4,4, # 0xA0
+    2,5,2,5,4,4,4,4,2,4,2,4,4,4,4,4, # 0xB0
+    2,6,2,8,3,3,5,5,2,2,2,2,4,4,6,6, # 0xC0
+    2,5,2,8,4,4,6,6,2,4,2,7,4,4,7,7, # 0xD0
+    2,6,2,8,3,3,5,5,2,2,2,2,4,4,6,6, # 0xE0
+    2,5,2,8,4,4,6,6,2,4,2,7,4,4,7,7, # 0xF0
+]
+
 def initialize():
-  global A, X, Y, PC, S, P, opcode
+  global A, X, Y, PC, S, P, opcode, cycles, nmi_pending, frame_end
     
   A  = 0
   X  = 0
@@ -48,13 +81,35 @@ def initialize():
   S  = 0x01FF
   P  = 0
   opcode = 0
+  cycles = 0
+  nmi_pending = False
+  frame_end = 0.0
 
 def cycle():
-  global PC, opcode
+  global PC, opcode, cycles
+  if nmi_pending:
+    nmi()
   opcode = mem.memory[PC]
   #debug()
+  # Counted before decoding, a register access sees the cycle the
+  # instruction ends at
+  cycles += cycle_table[opcode]
   decode(opcode)
 
+## Interrupts
+# NMI - Non-Maskable Interrupt
+# Pushed the same way as BRK, the handler address is in 0xFFFA-0xFFFB
+def nmi():
+  global PC, cycles, nmi_pending
+  nmi_pending = False
+
+  s_push_word(PC)
+  s_push(P)
+  set_interrupt_flag(0xFF)
+
+  PC = (mem.memory[0xFFFB] << 8) | mem.memory[0xFFFA]
+  cycles += 7
+
 def decode(opcode):
   global A, X, Y, PC, S, P
 
@@ -325,7 +380,7 @@ def decode(opcode):
     
     set_carry_flag(mem.memory[loc] >> 7)
     
-    mem.memory[loc] <<= 1
+    mem.write(loc, mem.memory[loc] << 1)
     
     set_zero_flag(mem.memory[loc])
     set_negative_flag(0x0)
@@ -344,7 +399,7 @@ def decode(opcode):
 
     set_carry_flag(mem.memory[loc] >> 7)
     
-    mem.memory[loc] <<= 1
+    mem.write(loc, mem.memory[loc] << 1)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(0x0)
@@ -363,7 +418,7 @@ def decode(opcode):
 
     set_carry_flag(mem.memory[loc] >> 7)
     
-    mem.memory[loc] <<= 1
+    mem.write(loc, mem.memory[loc] << 1)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(0x0)
@@ -382,7 +437,7 @@ def decode(opcode):
 
     set_carry_flag(mem.memory[loc] >> 7)
     
-    mem.memory[loc] <<= 1
+    mem.write(loc, mem.memory[loc] << 1)
     
     set_zero_flag(mem.memory[loc])
     set_negative_flag(0x0)
@@ -550,11 +605,12 @@ def decode(opcode):
     # absolute      BIT oper      2C    3     4
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    tmp = A & mem.memory[loc]
+    value = mem.read(loc)
+    tmp = A & value
     
     P &= 0b1011_1111 # Clears previus V flag
-    P |= mem.memory[loc] >> 6
-    set_negative_flag(mem.memory[loc] >> 7)
+    P |= value >> 6
+    set_negative_flag(value >> 7)
     
     set_zero_flag(tmp)
 
@@ -663,7 +719,7 @@ def decode(opcode):
 
     set_interrupt_flag(0xFF)
 
-    s_push(PC + 2)
+    s_push_word(PC + 2)
     s_push(P)
 
     PC += 1
@@ -1030,7 +1086,7 @@ def decode(opcode):
     # zeropage      DEC oper      C6    2     5
 
     loc = mem.memory[PC + 1]
-    mem.memory[loc] -= 1
+    mem.write(loc, mem.memory[loc] - 1)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(mem.memory[loc])
@@ -1046,7 +1102,7 @@ def decode(opcode):
     # zeropage,X    DEC oper,X    D6    2     6
 
     loc = (mem.memory[PC + 1] + X) & 0x00FF
-    mem.memory[loc] -= 1
+    mem.write(loc, mem.memory[loc] - 1)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(mem.memory[loc])
@@ -1062,7 +1118,7 @@ def decode(opcode):
     # absolute      DEC oper      CE    3     6
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    mem.memory[loc] -= 1
+    mem.write(loc, mem.memory[loc] - 1)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(mem.memory[loc])
@@ -1078,7 +1134,7 @@ def decode(opcode):
     # absolute,X    DEC oper,X    DE    3     7
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    mem.memory[loc + X] -= 1
+    mem.write(loc + X, mem.memory[loc + X] - 1)
 
     set_zero_flag(mem.memory[loc + X])
     set_negative_flag(mem.memory[loc + X])
@@ -1258,7 +1314,7 @@ def decode(opcode):
     # zeropage      INC oper      E6    2     5
 
     loc = mem.memory[PC + 1]
-    mem.memory[loc] += 1
+    mem.write(loc, mem.memory[loc] + 1)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(mem.memory[loc])
@@ -1274,7 +1330,7 @@ def decode(opcode):
     # zeropage,X    INC oper,X    F6    2     6
 
     loc = (mem.memory[PC + 1] + X) & 0x00FF
-    mem.memory[loc] += 1
+    mem.write(loc, mem.memory[loc] + 1)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(mem.memory[loc])
@@ -1290,7 +1346,7 @@ def decode(opcode):
     # absolute      INC oper      EE    3     6
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    mem.memory[loc] += 1
+    mem.write(loc, mem.memory[loc] + 1)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(mem.memory[loc])
@@ -1306,7 +1362,7 @@ def decode(opcode):
     # aabsolute,X    INC oper,X    FE    3     7
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    mem.memory[loc + X] += 1
+    mem.write(loc + X, mem.memory[loc + X] + 1)
 
     set_zero_flag(mem.memory[loc + X])
     set_negative_flag(mem.memory[loc + X])
@@ -1382,7 +1438,7 @@ def decode(opcode):
     #  --------------------------------------------
     #  absolute      JSR oper      20    3     6
     
-    s_push(PC + 2)
+    s_push_word(PC + 2)
     
     PC = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
 
@@ -1444,7 +1500,7 @@ def decode(opcode):
     # Absolute      LDA           AD    3     4
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    A = mem.memory[loc]
+    A = mem.read(loc)
 
     set_zero_flag(A)
     set_negative_flag(A)
@@ -1461,7 +1517,7 @@ def decode(opcode):
     # * Add 1 if page boundary is crossed
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    A = mem.memory[loc + X]
+    A = mem.read(loc + X)
 
     set_zero_flag(A)
     set_negative_flag(A)
@@ -1478,7 +1534,7 @@ def decode(opcode):
     # * Add 1 if page boundary is crossed
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    A = mem.memory[loc + Y]
+    A = mem.read(loc + Y)
 
     set_zero_flag(A)
     set_negative_flag(A)
@@ -1577,7 +1633,7 @@ def decode(opcode):
     # absolute      LDX oper      AE    3     4
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    X = mem.memory[loc]
+    X = mem.read(loc)
 
     set_zero_flag(X)
     set_negative_flag(X)
@@ -1594,7 +1650,7 @@ def decode(opcode):
     # * Add 1 if page boundary is crossed
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    X = mem.memory[loc + Y]
+    X = mem.read(loc + Y)
 
     set_zero_flag(X)
     set_negative_flag(X)
@@ -1658,7 +1714,7 @@ def decode(opcode):
     # absolute      LDY oper      AC    3     4
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    Y = mem.memory[loc]
+    Y = mem.read(loc)
 
     set_zero_flag(Y)
     set_negative_flag(Y)
@@ -1675,7 +1731,7 @@ def decode(opcode):
     # * Add 1 if page boundary is crossed
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    Y = mem.memory[loc + X]
+    Y = mem.read(loc + X)
 
     set_zero_flag(Y)
     set_negative_flag(Y)
@@ -1712,7 +1768,7 @@ def decode(opcode):
     
     set_carry_flag(mem.memory[loc])
     
-    mem.memory[loc] >>= 1
+    mem.write(loc, mem.memory[loc] >> 1)
     
     set_zero_flag(mem.memory[loc])
     set_negative_flag(0x0)
@@ -1731,7 +1787,7 @@ def decode(opcode):
 
     set_carry_flag(mem.memory[loc])
     
-    mem.memory[loc] >>= 1
+    mem.write(loc, mem.memory[loc] >> 1)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(0x0)
@@ -1750,7 +1806,7 @@ def decode(opcode):
 
     set_carry_flag(mem.memory[loc])
     
-    mem.memory[loc] >>= 1
+    mem.write(loc, mem.memory[loc] >> 1)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(0x0)
@@ -1769,7 +1825,7 @@ def decode(opcode):
 
     set_carry_flag(mem.memory[loc])
     
-    mem.memory[loc] >>= 1
+    mem.write(loc, mem.memory[loc] >> 1)
     
     set_zero_flag(mem.memory[loc])
     set_negative_flag(0x0)
@@ -2007,8 +2063,7 @@ def decode(opcode):
     carry = P & 0b1
     set_carry_flag(mem.memory[loc] >> 7)
     
-    mem.memory[loc] <<= 1
-    mem.memory[loc] |= carry
+    mem.write(loc, (mem.memory[loc] << 1) | carry)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(mem.memory[loc])
@@ -2028,8 +2083,7 @@ def decode(opcode):
     carry = P & 0b1
     set_carry_flag(mem.memory[loc] >> 7)
     
-    mem.memory[loc] <<= 1
-    mem.memory[loc] |= carry
+    mem.write(loc, (mem.memory[loc] << 1) | carry)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(mem.memory[loc])
@@ -2049,8 +2103,7 @@ def decode(opcode):
     carry = P & 0b1
     set_carry_flag(mem.memory[loc] >> 7)
     
-    mem.memory[loc] <<= 1
-    mem.memory[loc] |= carry
+    mem.write(loc, (mem.memory[loc] << 1) | carry)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(mem.memory[loc])
@@ -2070,8 +2123,7 @@ def decode(opcode):
     carry = P & 0b1
     set_carry_flag(mem.memory[loc] >> 7)
     
-    mem.memory[loc] <<= 1
-    mem.memory[loc] |= carry
+    mem.write(loc, (mem.memory[loc] << 1) | carry)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(mem.memory[loc])
@@ -2110,8 +2162,7 @@ def decode(opcode):
     carry = (P & 0b1) << 7
     set_carry_flag(mem.memory[loc])
     
-    mem.memory[loc] >>= 1
-    mem.memory[loc] |= carry
+    mem.write(loc, (mem.memory[loc] >> 1) | carry)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(mem.memory[loc])
@@ -2131,8 +2182,7 @@ def decode(opcode):
     carry = (P & 0b1) << 7
     set_carry_flag(mem.memory[loc])
     
-    mem.memory[loc] >>= 1
-    mem.memory[loc] |= carry
+    mem.write(loc, (mem.memory[loc] >> 1) | carry)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(mem.memory[loc])
@@ -2152,8 +2202,7 @@ def decode(opcode):
     carry = (P & 0b1) << 7
     set_carry_flag(mem.memory[loc])
     
-    mem.memory[loc] >>= 1
-    mem.memory[loc] |= carry
+    mem.write(loc, (mem.memory[loc] >> 1) | carry)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(mem.memory[loc])
@@ -2173,8 +2222,7 @@ def decode(opcode):
     carry = (P & 0b1) << 7
     set_carry_flag(mem.memory[loc])
     
-    mem.memory[loc] >>= 1
-    mem.memory[loc] |= carry
+    mem.write(loc, (mem.memory[loc] >> 1) | carry)
 
     set_zero_flag(mem.memory[loc])
     set_negative_flag(mem.memory[loc])
@@ -2193,7 +2241,7 @@ def decode(opcode):
     #   implied       RTI           40    1     6
 
     P = s_pull()
-    PC = s_pull()
+    PC = s_pull_word()
 
   elif opcode == 0x60: # RTS - Return from Subroutine
     # pull PC
@@ -2205,7 +2253,7 @@ def decode(opcode):
     #   --------------------------------------------
     #   implied       RTS           60    1     6
 
-    PC = s_pull()
+    PC = s_pull_word()
 
     PC += 1
 
@@ -2498,7 +2546,7 @@ def decode(opcode):
 
     loc = mem.memory[PC + 1]
     real_loc = (mem.memory[loc + X + 1] << 8) | mem.memory[loc + X]
-    mem.memory[real_loc] = A
+    mem.write(real_loc, A)
     
     PC += 2
   elif opcode == 0x85: # STA - Store Accumulator in Memory
@@ -2510,7 +2558,7 @@ def decode(opcode):
     #   --------------------------------------------
     #   zeropage      STA oper      85    2     3
 
-    mem.memory[PC + 1] = A
+    mem.write(PC + 1, A)
     
     PC += 2
   elif opcode == 0x8D: # STA - Store Accumulator in Memory
@@ -2524,7 +2572,7 @@ def decode(opcode):
 
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    mem.memory[loc] = A
+    mem.write(loc, A)
     
     PC += 3
   elif opcode == 0x91: # STA - Store Accumulator in Memory
@@ -2538,7 +2586,7 @@ def decode(opcode):
 
     loc = mem.memory[PC + 1]
     real_loc = (mem.memory[loc + 1] << 8) | mem.memory[loc]
-    mem.memory[real_loc + Y] = A
+    mem.write(real_loc + Y, A)
     
     PC += 2
   elif opcode == 0x95: # STA - Store Accumulator in Memory
@@ -2550,7 +2598,7 @@ def decode(opcode):
     #   --------------------------------------------
     #   zeropage,X    STA oper,X    95    2     4
 
-    mem.memory[(PC + 1 + X) & 0xFF] = A
+    mem.write((PC + 1 + X) & 0xFF, A)
     
     PC += 2
   elif opcode == 0x99: # STA - Store Accumulator in Memory
@@ -2564,7 +2612,7 @@ def decode(opcode):
 
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    mem.memory[loc + Y] = A
+    mem.write(loc + Y, A)
     
     PC += 3
   elif opcode == 0x9D: # STA - Store Accumulator in Memory
@@ -2578,7 +2626,7 @@ def decode(opcode):
 
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    mem.memory[loc + X] = A
+    mem.write(loc + X, A)
     
     PC += 3
 
@@ -2591,7 +2639,7 @@ def decode(opcode):
     #   --------------------------------------------
     #   zeropage      STX oper      86    2     3
 
-    mem.memory[PC + 1] = X
+    mem.write(PC + 1, X)
     
     PC += 2
   elif opcode == 0x96: # STX - Store Index X in Memory
@@ -2603,7 +2651,7 @@ def decode(opcode):
     #   --------------------------------------------
     #   zeropage,Y    STX oper,Y    96    2     4
 
-    mem.memory[(PC + 1 + Y) & 0xFF] = X
+    mem.write((PC + 1 + Y) & 0xFF, X)
     
     PC += 2
   elif opcode == 0x8E: # STX - Store Index X in Memory
@@ -2616,7 +2664,7 @@ def decode(opcode):
     #   absolute      STX oper      8E    3     4
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    mem.memory[loc] = X
+    mem.write(loc, X)
     
     PC += 3
 
@@ -2629,7 +2677,7 @@ def decode(opcode):
     #   --------------------------------------------
     #   zeropage      STY oper      84    2     3
 
-    mem.memory[PC + 1] = Y
+    mem.write(PC + 1, Y)
     
     PC += 2
   elif opcode == 0x94: # STY - Sore Index Y in Memory
@@ -2641,7 +2689,7 @@ def decode(opcode):
     #   --------------------------------------------
     #   zeropage,X    STY oper,X    94    2     4
 
-    mem.memory[(PC + 1 + X) & 0xFF] = Y
+    mem.write((PC + 1 + X) & 0xFF, Y)
     
     PC += 2
   elif opcode == 0x8C: # STY - Sore Index Y in Memory
@@ -2655,7 +2703,7 @@ def decode(opcode):
 
 
     loc = (mem.memory[PC + 2] << 8) | mem.memory[PC + 1]
-    mem.memory[loc] = Y
+    mem.write(loc, Y)
     
     PC += 3
 
@@ -2800,7 +2848,7 @@ def set_negative_flag(value):
 # Stack Pointer
 def s_push(value):
   global S
-  mem.memory[S] = value
+  mem.memory[S] = value & 0xFF
   S = ((S + 0x1) & 0x00FF) | 0x0100
 
 def s_pull():
@@ -2808,6 +2856,15 @@ def s_pull():
   S = ((S - 0x1) & 0x00FF) | 0x0100
   return mem.memory[S]
 
+# Addresses take two stack bytes, high byte first
+def s_push_word(value):
+  s_push(value >> 8)
+  s_push(value)
+
+def s_pull_word():
+  low = s_pull()
+  return (s_pull() << 8) | low
+
 # Debug
 def debug():
   global A, X, Y, PC, S, P, opcode
@@ -0,0 +1,132 @@
+import threading
+import numpy as np
+import ppu
+import scaler
+import video
+
+# pygame is only imported when a window is opened
+pygame = None
+screen = None
+
+# Window size is 256x240 times scale. With the 'scale2x' filter the frame
+# is doubled with Scale2x first, so scale must be even.
+scale  = 1
+scale_filter = 'nearest'
+
+# colour_palette mapped to the pixel format of the window
+colour_table = None
+
+#  Presenter Thread
+#
+#  Converting, scaling and flipping run on their own thread so emulation
+#  never waits for the display (or for vsync).
+#
+#   Emulation                          Presenter
+#  +-----------+  show()   +--------+  wait   +-----------+
+#  | ppu.frame | --------> |  back  | ------> |   front   | -> flip()
+#  +-----------+           +--------+         +-----------+
+#
+#  The PPU never writes to a finished frame, so handing a frame over is
+#  only a reference swap. A frame that is replaced in back before the
+#  presenter takes it is never shown, the newest complete frame always is.
+#  swap_lock is only held for the swap itself, never while presenting.
+threaded  = True
+presenter = None
+running   = False
+
+back  = None
+front = None
+swap_lock = threading.Lock()
+frame_available = threading.Event()
+
+# Frames shown and frames replaced before being shown
+presented = 0
+replaced  = 0
+
+def initialize(window_scale=1, window_filter='nearest', presenter_thread=True):
+  global pygame, screen, scale, scale_filter, colour_table, threaded
+
+  import pygame
+
+  pygame.display.init()
+
+  scale  = window_scale
+  scale_filter = window_filter if window_scale % 2 == 0 else 'nearest'
+
+  screen = pygame.display.set_mode((256 * scale, 240 * scale), 0, 32)
+  pygame.display.set_caption('Nintendo')
+
+  colour_table = np.array([screen.map_rgb(colour) for colour in ppu.colour_palette], dtype=np.uint32)
+
+  threaded = presenter_thread
+  if threaded:
+    start_presenter()
+
+# Hands a finished frame to the display
+def show(frame):
+  global back, replaced
+
+  if not threaded:
+    present(frame)
+    return
+
+  with swap_lock:
+    if back is not None:
+      replaced += 1
+    back = frame
+  frame_available.set()
+
+# Converts, scales and flips a frame, the last one by default
+def present(frame=None):
+  global presented
+
+  frame = video.indices(frame)
+  factor = scale
+
+  if scale_filter == 'scale2x':
+    frame = scaler.scale2x(frame)
+    factor //= 2
+
+  # surfarray is indexed [x][y], transposed it is the surface memory
+  pixels = pygame.surfarray.pixels2d(screen)
+  scaler.nearest(colour_table[frame], factor, pixels.T)
+  del pixels
+
+  pygame.display.flip()
+  presented += 1
+
+def start_presenter():
+  global presenter, running
+
+  running = True
+  presenter = threading.Thread(target=present_loop, name='presenter', daemon=True)
+  presenter.start()
+
+def present_loop():
+  global back, front
+
+  while True:
+    frame_available.wait()
+    frame_available.clear()
+
+    if not running:
+      break
+
+    with swap_lock:
+      front, back = back, None
+    if front is not None:
+      present(front)
+
+def stop_presenter():
+  global running
+
+  if presenter is None:
+    return
+
+  running = False
+  frame_available.set()
+  presenter.join()
+
+def close():
+  stop_presenter()
+  pygame.quit()
@@ -0,0 +1,52 @@
+import os
+import struct
+import sys
+import zlib
+import ppu
+import recorder
+
+# Exports a NESV recording as a PNG sequence
+#
+#   python export.py recording.nesv output_directory
+#
+# Frames are written as 8-bit indexed PNGs, the palette is colour_palette
+# so the colour indexes are stored as they are.
+
+def png_chunk(kind, data):
+  chunk = kind + data
+  return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk))
+
+def png(frame, palette):
+  width, height = recorder.WIDTH, recorder.HEIGHT
+
+  # Each row starts with filter type 0 (None)
+  rows = bytearray()
+  for y in range(height):
+    rows.append(0)
+    rows += frame[y * width:(y + 1) * width]
+
+  return (b'\x89PNG\r\n\x1a\n'
+    + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0))
+    + png_chunk(b'PLTE', palette)
+    + png_chunk(b'IDAT', zlib.compress(bytes(rows), 6))
+    + png_chunk(b'IEND', b''))
+
+def export(path, directory):
+  os.makedirs(directory, exist_ok=True)
+
+  palette = bytes(c for colour in ppu.colour_palette for c in colour)
+
+  count = 0
+  for frame in recorder.read_nesv(path):
+    with open(os.path.join(directory, 'frame_%06d.png' % count), 'wb') as image:
+      image.write(png(frame, palette))
+    count += 1
+
+  return count
+
+if __name__ == '__main__':
+  if len(sys.argv) != 3:
+    print('Usage: python export.py recording.nesv output_directory')
+    sys.exit(1)
+
+  print(export(sys.argv[1], sys.argv[2]), 'frames exported')
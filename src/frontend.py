@@ -0,0 +1,74 @@
+import time
+import multiprocessing
+import apu
+import shared
+import input as controller
+
+# Front-End Process
+#
+# With --split the emulation core runs in a child process and this one
+# only does what needs the window: keyboard, scaling, presentation and the
+# audio device. Frames and samples come through shared memory (shared.py),
+# so both processes run on their own core with their own GIL.
+#
+#   Core process                        Front-end process
+#  +-------------+   frames, samples  +---------------------+
+#  | CPU/PPU/APU | -----------------> | display, audio      |
+#  |             | <----------------- | keyboard            |
+#  +-------------+   ports, stop      +---------------------+
+#
+# Other processes (encoders, viewers) can attach to the same block by name
+# with shared.attach() and read frames with shared.read_frame().
+
+# Time slept between polls while there is nothing new
+POLL_INTERVAL = 0.001
+
+# core is a function started in the child with the block name as its only
+# argument, it has to attach, run and mark the block FINISHED
+def run(core, scale=1, scale_filter='nearest', audio_seconds=0.5):
+  import display
+  import audio
+
+  name = shared.create(audio_capacity=int(apu.SAMPLE_RATE * audio_seconds))
+  print('shared frame buffer:', name)
+
+  process = multiprocessing.Process(target=core, args=(name,), name='core')
+  process.start()
+
+  try:
+    display.initialize(scale, scale_filter)
+    sound = audio.initialize(apu.SAMPLE_RATE)
+    controller.initialize(True)
+
+    # Without an audio device the samples are dropped as fast as a device
+    # would play them, so the core is still paced by them
+    received = played = 0
+    last = time.perf_counter()
+
+    sequence = 0
+    while controller.poll() and shared.state() != shared.FINISHED and process.is_alive():
+      shared.write_ports(controller.ports)
+
+      if shared.frame_sequence() != sequence:
+        frame, sequence = shared.read_frame()
+        display.show(frame)
+
+      if sound:
+        if shared.audio_fill():
+          audio.write(shared.read_audio())
+        shared.set_device_fill(audio.fill())
+      else:
+        received += len(shared.read_audio())
+        now = time.perf_counter()
+        played = min(received, played + (now - last) * apu.SAMPLE_RATE)
+        last = now
+        shared.set_device_fill(int(received - played))
+
+      time.sleep(POLL_INTERVAL)
+
+    display.close()
+    audio.close()
+  finally:
+    shared.set_state(shared.STOPPING)
+    process.join()
+    shared.close(unlink=True)
@@ -1,19 +1,104 @@
+# Controllers
+#
+# Both ports hold the state of the 8 buttons packed in one byte, in the
+# order the NES reads them:
+#
+# +-+-+-+-+-+-+-+-+
+# |R|L|D|U|T|S|B|A|
+# +-+-+-+-+-+-+-+-+
+#  7 6 5 4 3 2 1 0
+#
+# A - A, B - B, S - Select, T - Start, U - Up, D - Down, L - Left, R - Right
+#
+# The state is only updated by poll(), once per frame. Writing 1 and then
+# 0 to 0x4016 (strobe) latches it into each port's shift register, every
+# read of 0x4016 (port 1) or 0x4017 (port 2) returns the next bit.
 
 # The list is in the orther that the NES reads the status of the controller
-
-input_schema = [
+input_schema = {
   'N': 0, # A
-  'M': 0, # B
-  'H': 0, # Select
-  'J': 0, # Start
-  'W': 0, # Up
-  'S': 0, # Down
-  'A': 0, # Left
-  'D': 0  # Right
-]
-
-def initialize()
-  global input_schema
-
-  for k in input_schema.keys():
-    input_schema[k] = 0
+  'M': 1, # B
+  'H': 2, # Select
+  'J': 3, # Start
+  'W': 4, # Up
+  'S': 5, # Down
+  'A': 6, # Left
+  'D': 7  # Right
+}
+
+# Keys of the second controller, none by default
+input_schema_2 = {}
+
+ports  = [0, 0]
+shift  = [0, 0]
+strobe = 0
+
+# Held to rewind (when the rewind buffer is on)
+rewind_key = 'backspace'
+rewinding  = False
+
+# pygame key code -> (port, bit), built by initialize()
+pygame = None
+key_map = {}
+
+def initialize(keyboard=True):
+  global ports, shift, strobe, pygame, key_map, rewinding
+
+  ports  = [0, 0]
+  shift  = [0, 0]
+  strobe = 0
+  rewinding = False
+
+  key_map = {}
+  if keyboard:
+    import pygame
+
+    for port, schema in enumerate((input_schema, input_schema_2)):
+      for key, bit in schema.items():
+        key_map[pygame.key.key_code(key.lower())] = (port, bit)
+
+# Drains the event queue, returns False when the window is closed
+def poll():
+  global rewinding
+
+  running = True
+
+  for event in pygame.event.get():
+    if event.type == pygame.KEYDOWN or event.type == pygame.KEYUP:
+      if event.key == pygame.key.key_code(rewind_key):
+        rewinding = event.type == pygame.KEYDOWN
+
+      button = key_map.get(event.key)
+      if button:
+        port, bit = button
+        if event.type == pygame.KEYDOWN:
+          ports[port] |= 1 << bit
+        else:
+          ports[port] &= ~(1 << bit) & 0xFF
+    elif event.type == pygame.QUIT:
+      running = False
+
+  return running
+
+## Bus
+
+# CPU writes to 0x4016
+def write_strobe(value):
+  global strobe
+
+  strobe = value & 0x1
+  if strobe:
+    shift[0] = ports[0]
+    shift[1] = ports[1]
+
+# CPU reads of 0x4016 (port 0) and 0x4017 (port 1)
+def read(port):
+  # While strobe is high the shift register keeps reloading, A is returned
+  if strobe:
+    return 0x40 | (ports[port] & 0x1)
+
+  bit = shift[port] & 0x1
+  # After 8 reads official controllers return 1
+  shift[port] = (shift[port] >> 1) | 0x80
+  # Bit 6 is open bus, usually 1 from the 0x40 of the address
+  return 0x40 | bit
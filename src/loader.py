@@ -1,5 +1,6 @@
 import os
 import memory as mem
+import ppu
 import config
 
 # ROM iNES - Super Mario (E)
@@ -8,10 +9,10 @@ import config
 # 0-3: 0x4e 0x45 0x53 0x1A - "NES" followerd by MS-DOS end of file
 # 4  : 0x2                 - Size of the PRG ROM in 16KB units (32768 KB)
 # 5  : 0x1                 - Size of the CHR ROM in 8KB units (8192 KB)
-# 6  : 0x1                 - FLAGS - 1 means vertical mirroring
+# 6  : 0x1                 - FLAGS - 1 means vertical mirroring, 2 battery
 # 7  : 0x0                 - FLAGS
 # 8  : 0x0                 - PRG-RAM size
-# 9  : 0x0                 - TV system
+# 9  : 0x0                 - TV system (the file name says PAL)
 # 10 : 0x0                 - TV system, PRG-RAM presence
 # 11-15 : 0x0              - Unused padding
 
@@ -21,7 +22,15 @@ import config
 # 2 -> Archaic iNES
 rom_type = 0
 
+# Whole ROM file, PRG and CHR are views into it
+data = b''
+chr_rom = memoryview(b'')
+
+# Header byte 6, bit 1, PRG-RAM is kept by a battery
+battery = False
+
 def load_file(rom):  
+  global data, chr_rom, battery
   
   # Open ROM file
   with open(rom, 'rb') as rom:
@@ -52,6 +61,42 @@ def load_file(rom):
     for i in range(0x4000):
       mem.memory[0xC000 + i] = int.from_bytes(rom.read(1), "big")
 
+    rom.seek(0)
+    data = rom.read()
+
+  # Load CHR - Pattern tables
+  # Located after the PRG pages, 0x0000 -> Pattern Tables
+  chr_start = config.prg_start + header[0x4] * 0x4000
+  chr_rom = memoryview(data)[chr_start:chr_start + header[0x5] * 0x2000]
+  ppu.load_chr(chr_rom)
+
+  # TV system, the CPU, PPU and APU timing depend on it
+  config.set_region(tv_system(header, os.path.basename(rom.name)))
+
+  battery = bool(header[0x6] & 0b00000010)
+
+  # Nametable mirroring
+  # Byte 6, bit 3 -> four screen VRAM, bit 0 -> 1 vertical, 0 horizontal
+  if header[0x6] & 0b00001000:
+    ppu.set_mirroring(ppu.FOUR_SCREEN)
+  elif header[0x6] & 0b00000001:
+    ppu.set_mirroring(ppu.VERTICAL)
+  else:
+    ppu.set_mirroring(ppu.HORIZONTAL)
+
+# NES 2.0: byte 12, bits 0-1 -> 0 NTSC, 1 PAL, 2 both, 3 Dendy
+# iNES:    byte 9, bit 0 -> 1 PAL, byte 10, bits 0-1 -> 2 PAL (unofficial)
+# Most dumps leave these bytes empty, so an NTSC header on a file tagged
+# (E) or (Europe) is taken as PAL
+def tv_system(header, name):
+  if header[0x7] & 0x0C == 0x08:
+    return {1: config.PAL, 3: config.DENDY}.get(header[0xC] & 0x3, config.NTSC)
+  if header[0x9] & 0x1 or header[0xA] & 0x3 == 0x2:
+    return config.PAL
+  if '(E)' in name or '(Europe)' in name:
+    return config.PAL
+  return config.NTSC
+
 def is_ines(header):
   if header[0x7] & 0x0C == 0x00:
     for i in range(12, 16):
@@ -1,41 +1,332 @@
+import os
+import sys
+import time
+import config
 import loader
 import memory as mem
 import cpu
 import ppu
-import pygame
+import apu
+import recorder
+import pacing
+import shared
+import rewind
+import runahead
+import battery
+import input as controller
+import movie
 
-def initialize():
-  display_buffer = [0] * 256 * 240
+# Headless mode, no window and no pygame. Frames are read with
+# video.indices() and video.rgb() after run_frame().
+headless = False
 
-  screen = pygame.display.set_mode((256, 240))
-  pygame.display.flip()
-  pygame.display.update()
+def initialize(rom, headless_mode=False, scale=1, scale_filter='nearest', region=None, battery_save=True):
+  global headless
 
-  pygame.display.set_caption('Nintendo')
+  headless = headless_mode
 
-def start_emulator():
-  pygame.init()
-
-  initialize()
+  sound = False
+  if not headless:
+    import display
+    import audio
+    display.initialize(scale, scale_filter)
+    sound = audio.initialize(apu.SAMPLE_RATE)
 
+  # No samples are built without an audio device, here or in the front-end
+  apu.synthesize = (not headless and sound) or shared.attached
 
   # Start memory  
   mem.initialize()
 
   # Load rom
-  loader.load_file('SuperMarioBros(E).nes')
+  loader.load_file(rom)
+
+  # Battery-backed PRG-RAM, kept in a .sav file next to the ROM unless
+  # several instances run the same ROM (batch.py)
+  if loader.battery and battery_save:
+    battery.initialize(rom)
+
+  # Forced TV system, instead of the one read from the header
+  if region is not None:
+    config.set_region(config.region_names.get(region, region))
 
   # Start CPU
   cpu.initialize()
 
-  # Debug functions
-  
-  # Emulation Loop
-  while True:
+  # Start PPU
+  ppu.initialize()
+
+  # Start APU
+  apu.initialize()
+
+  # Start controllers, read from the keyboard when there is a window
+  controller.initialize(not headless)
+
+# Runs one frame worth of CPU cycles, the PPU finishes a frame during it
+def run_frame():
+  cpu.frame_end += config.frame_cycles
+  end = int(cpu.frame_end)
+
+  # The PPU only runs when the CPU touches its registers or reaches
+  # the next PPU event (vertical blank or end of frame)
+  while cpu.cycles < end:
     cpu.cycle()
-    ppu.cycle()
+    if cpu.cycles >= ppu.next_event:
+      ppu.catch_up()
+
+# Runs a frame and hands it to the audio device and the recorder, returns
+# False when there is nothing left to run (end of movie)
+def next_frame():
+  # In the core process the keyboard is read by the front-end
+  if shared.attached:
+    controller.ports[0], controller.ports[1] = shared.read_ports()
+
+  if movie.mode == 'play':
+    if not movie.play():
+      return False
+  elif movie.mode == 'record':
+    movie.record(controller.ports)
+
+  # With run-ahead the real frame is never shown
+  render = ppu.render_enabled
+  if runahead.frames:
+    ppu.render_enabled = False
+
+  run_frame()
+
+  pacing.adjust_audio_rate()
+  samples = apu.end_frame()
+
+  if runahead.frames:
+    runahead.run(run_frame, render)
+  if not headless:
+    import audio
+    audio.write(samples)
+  elif shared.attached:
+    shared.write_audio(samples)
+
+  if shared.attached and ppu.render_enabled:
+    shared.write_frame(ppu.frame)
+
+  if recorder.recording and ppu.render_enabled:
+    recorder.push(ppu.frame)
+
+  if rewind.enabled:
+    rewind.push()
+
+  battery.update()
+
+  return True
+
+def start_emulator(rom='SuperMarioBros(E).nes', headless_mode=False, record=None, scale=1, scale_filter='nearest', pacing_mode='audio', movie_path=None, movie_mode='play', turbo=False, speed=1.0, frame_skip=2, region=None, frames=None, bench=False, split=False, control=None, rewind_mb=0, rewind_interval=4, run_ahead=0):
+  # The core runs in a child process, this one becomes the front-end
+  if split and not headless_mode:
+    import functools
+    import frontend
+
+    core = functools.partial(run_core, rom=rom, record=record, pacing_mode=pacing_mode,
+      movie_path=movie_path, movie_mode=movie_mode, turbo=turbo, speed=speed,
+      frame_skip=frame_skip, region=region, frames=frames, rewind_mb=rewind_mb,
+      rewind_interval=rewind_interval, run_ahead=run_ahead)
+    frontend.run(core, scale, scale_filter)
+    return
+
+  initialize(rom, headless_mode, scale, scale_filter, region)
+
+  runahead.initialize(run_ahead)
+
+  # Snapshots for the rewind key (and the control socket)
+  if rewind_mb:
+    rewind.initialize(rewind_interval, rewind_mb)
+
+  # Input movie, played movies drive the controllers
+  if movie_path and movie_mode == 'record':
+    movie.start_recording(movie_path)
+  elif movie_path:
+    movie.start_playback(movie_path)
+
+  # Headless and turbo run as fast as possible, the core of a split run is
+  # paced from the front-end's audio
+  unpaced = turbo or (headless and not shared.attached)
+
+  # Without an audio device there is no audio clock to pace from
+  if pacing_mode == 'audio' and not headless and not apu.synthesize:
+    pacing_mode = 'wall'
+  pacing.initialize('none' if unpaced else pacing_mode, speed_multiplier=speed, max_frame_skip=frame_skip)
 
+  # Debug functions
+
+  if record:
+    recorder.start(record, 'y4m' if record.endswith('.y4m') else 'nesv', config.frame_rate)
   
+  # Emulation Loop, runs until the window is closed, the movie ends or
+  # frames frames have run
+  count = 0
+  start = time.perf_counter()
+  try:
+    if control:
+      # asyncio loop with a control socket, no presenter thread
+      import runner
+      show = poll = None
+      if not headless:
+        import display
+        display.stop_presenter()
+        display.threaded = False
+        show, poll = display.show, controller.poll
+      count = runner.run(control, next_frame, show, poll, frames)
+      if not headless:
+        display.close()
+    elif shared.attached:
+      while count != frames and shared.state() == shared.RUNNING:
+        skip = pacing.should_skip()
+        ppu.render_enabled = not skip
+
+        if not next_frame():
+          break
+        count += 1
+        pacing.wait()
+    elif headless:
+      while count != frames and next_frame():
+        count += 1
+    else:
+      import display
+      while count != frames and controller.poll():
+        # While the rewind key is held every frame goes back a snapshot
+        if controller.rewinding and rewind.enabled:
+          rewind.rewind()
+          ppu.render_frame()
+          display.show(ppu.frame)
+          pacing.wait_deadline()
+          continue
+
+        # Behind real time, the frame is run without pixel output
+        skip = pacing.should_skip()
+        ppu.render_enabled = not skip
+
+        if not next_frame():
+          break
+        count += 1
+        if not skip:
+          display.show(ppu.frame)
+        pacing.wait()
+
+      display.close()
+  finally:
+    elapsed = time.perf_counter() - start
+
+    if not headless:
+      import audio
+      audio.close()
+
+    recorder.stop()
+    battery.close()
+
+    if pacing.skipped_frames:
+      print('%d frames skipped' % pacing.skipped_frames)
+
+    if runahead.count:
+      print('run-ahead %d: %.3f ms/frame (save/load %.3f ms, frames ahead %.3f ms)' % (
+        (runahead.frames,) + runahead.overhead()))
+
+    # Benchmarks and played movies are repeatable runs
+    if (bench or movie.mode == 'play') and count:
+      print('%d frames in %.2f s, %.1f fps, %.3f ms/frame, %.2fx real time' % (
+        count, elapsed, count / elapsed, elapsed * 1000 / count, count / elapsed / config.frame_rate))
+
+    movie.stop()
+
+  return count
+
+# Core process of a split run, started by frontend.run()
+def run_core(name, **options):
+  shared.attach(name, child=True)
+  try:
+    start_emulator(headless_mode=True, **options)
+  finally:
+    shared.set_state(shared.FINISHED)
+    shared.close()
+
+# Startup benchmark, time from launching a headless process to its first
+# CPU instruction. Batch runs start many short processes, the budget is
+# STARTUP_BUDGET seconds (median of runs).
+STARTUP_BUDGET = 0.1
+
+def bench_startup(rom, runs=10):
+  import subprocess
+
+  code = 'import sys; sys.path.insert(0, %r); import main; main.initialize(%r, True); main.cpu.cycle()' % (
+    os.path.dirname(os.path.abspath(__file__)), os.path.abspath(rom))
+
+  times = []
+  for _ in range(runs):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], check=True)
+    times.append(time.perf_counter() - start)
+
+  times.sort()
+  median = times[len(times) // 2]
+  print('time to first instruction: %.1f ms median, %.1f ms min (budget %d ms)%s' % (
+    median * 1000, times[0] * 1000, STARTUP_BUDGET * 1000, '' if median < STARTUP_BUDGET else ', over budget'))
+
+  return median < STARTUP_BUDGET
+
+def main(argv=None):
+  import argparse
+
+  parser = argparse.ArgumentParser(description='NES emulator')
+  parser.add_argument('rom', nargs='?', default='SuperMarioBros(E).nes', help='iNES ROM file')
+  parser.add_argument('--headless', action='store_true', help='no window, audio or keyboard')
+  parser.add_argument('--frames', type=int, metavar='N', help='stop after N frames')
+  parser.add_argument('--turbo', action='store_true', help='run unpaced, as fast as possible')
+  parser.add_argument('--speed', type=float, default=1.0, help='emulation speed multiplier')
+  parser.add_argument('--pacing', choices=['audio', 'wall', 'none'], default='audio', help='what frames are paced from')
+  parser.add_argument('--frame-skip', type=int, default=2, metavar='N', help='most frames skipped in a row when behind')
+  parser.add_argument('--region', choices=sorted(config.region_names), help='force the TV system')
+  parser.add_argument('--scale', type=int, default=1, help='window scale')
+  parser.add_argument('--filter', choices=['nearest', 'scale2x'], default='nearest', help='window scale filter')
+  parser.add_argument('--record', metavar='FILE', help='record video (.nesv or .y4m)')
+  parser.add_argument('--movie', metavar='FILE', help='play an input movie')
+  parser.add_argument('--record-movie', metavar='FILE', help='record an input movie')
+  parser.add_argument('--profile', nargs='?', const='-', metavar='FILE', help='run under cProfile, print the stats or save them to FILE')
+  parser.add_argument('--rewind', type=float, default=0, metavar='MB', help='keep a rewind buffer of up to MB megabytes (hold backspace)')
+  parser.add_argument('--rewind-interval', type=int, default=4, metavar='N', help='frames between rewind snapshots')
+  parser.add_argument('--run-ahead', type=int, default=0, metavar='N', help='run N frames ahead to hide input lag')
+  parser.add_argument('--control', metavar='ADDRESS', help='run on asyncio with a control socket (Unix socket path or HOST:PORT)')
+  parser.add_argument('--split', action='store_true', help='run the core in its own process, frames and audio through shared memory')
+  parser.add_argument('--bench', action='store_true', help='run headless and unpaced, report fps (600 frames unless --frames)')
+  parser.add_argument('--bench-startup', action='store_true', help='report time to first instruction of a headless process')
+  args = parser.parse_args(argv)
+
+  if args.bench_startup:
+    sys.exit(0 if bench_startup(args.rom) else 1)
+
+  if args.bench:
+    args.headless = True
+    if args.frames is None:
+      args.frames = 600
+
+  options = dict(
+    rom=args.rom, headless_mode=args.headless, record=args.record, scale=args.scale,
+    scale_filter=args.filter, pacing_mode=args.pacing, turbo=args.turbo, speed=args.speed,
+    frame_skip=args.frame_skip, region=args.region, frames=args.frames, bench=args.bench,
+    split=args.split, control=args.control, rewind_mb=args.rewind, rewind_interval=args.rewind_interval,
+    run_ahead=args.run_ahead,
+    movie_path=args.record_movie or args.movie, movie_mode='record' if args.record_movie else 'play')
+
+  if args.profile is None:
+    start_emulator(**options)
+    return
+
+  import cProfile
+  import pstats
+
+  profiler = cProfile.Profile()
+  profiler.runcall(start_emulator, **options)
 
+  if args.profile == '-':
+    pstats.Stats(profiler).sort_stats('tottime').print_stats(30)
+  else:
+    profiler.dump_stats(args.profile)
 
-start_emulator()
+if __name__ == '__main__':
+  main()
@@ -1,3 +1,7 @@
+import ppu
+import apu
+import input as controller
+
 
 #  CPU memory map
 #
@@ -27,12 +31,67 @@
 #  | Zero Page   |
 #  +-------------+ 0x0000
 #
-memory = []
+memory = bytearray(0x10000)
+
+# Battery-backed PRG-RAM, the mmap of the .sav file (see battery.py) that
+# writes to 0x6000-0x7FFF also go to. None without a battery.
+prg_ram = None
+prg_ram_dirty = False
+
+# Pages of 256 bytes written since the last clone or restore (see
+# savestate.clone()), one flag per page. Stack pushes go straight to
+# memory, the stack page is always treated as written.
+PAGE = 0x100
+dirty_pages = bytearray(b'\x01' * 0x100)
 
 def initialize():
-  global memory
+  global memory, prg_ram, prg_ram_dirty
+
+  memory = bytearray(0x10000)
+  prg_ram = None
+  prg_ram_dirty = False
+  mark_all_dirty()
+
+def mark_all_dirty():
+  dirty_pages[:] = b'\x01' * 0x100
+
+# CPU reads
+# Reads of 0x2000-0x3FFF are served by the PPU registers, 0x4015 by the APU
+# and 0x4016-0x4017 by the controllers
+def read(address):
+  if 0x2000 <= address < 0x4000:
+    return ppu.read_register(address)
+  elif address == 0x4015:
+    return apu.read_status()
+  elif address == 0x4016 or address == 0x4017:
+    return controller.read(address - 0x4016)
+
+  return memory[address]
+
+# CPU writes
+# The I/O registers are not plain memory, a write to 0x2000-0x3FFF
+# (0x2000-0x2007 and its mirrors) is forwarded to the PPU, a write
+# to 0x4014 starts the OAM DMA, 0x4016 strobes the controllers and the
+# rest of 0x4000-0x4017 are APU registers. With a battery, writes to
+# 0x6000-0x7FFF also land in the mapped .sav file.
+def write(address, value):
+  global memory, prg_ram_dirty
+
+  value &= 0xFF
+  if 0x2000 <= address < 0x4000:
+    ppu.write_register(address, value)
+  elif address == 0x4014:
+    ppu.write_dma(value)
+  elif address == 0x4016:
+    controller.write_strobe(value)
+  elif 0x4000 <= address <= 0x4017 and address != 0x4016:
+    apu.write(address, value)
+  elif 0x6000 <= address < 0x8000 and prg_ram is not None:
+    prg_ram[address - 0x6000] = value
+    prg_ram_dirty = True
 
-  memory = [0] * 0x10000
+  memory[address] = value
+  dirty_pages[address >> 8] = 1
 
 # Debug
 def debug():
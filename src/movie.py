@@ -0,0 +1,112 @@
+import struct
+import zlib
+import input as controller
+import loader
+
+# Input Movies
+#
+# A movie is the byte of both controller ports for every frame, stored as
+# runs of identical frames, so held (or no) buttons cost a few bytes.
+#
+#   +-----------------+
+#   | 'NESM'          | 4 bytes
+#   | Version         | 1 byte
+#   | ROM CRC32       | 4 bytes, little endian
+#   | Frames          | 4 bytes, little endian
+#   +-----------------+
+#   | Count           | 2 bytes, little endian  \
+#   | Port 1, Port 2  | 2 bytes                 / repeated for each run
+#   +-----------------+
+#
+# Playback writes the ports directly, the keyboard is not read.
+MAGIC   = b'NESM'
+VERSION = 1
+HEADER  = struct.Struct('<4sBII')
+RUN     = struct.Struct('<HBB')
+
+MAX_RUN = 0xFFFF
+
+# None, 'record' or 'play'
+mode = None
+path = None
+
+# Runs of [count, port 1, port 2]
+runs = []
+
+# Frames recorded or played
+frame = 0
+
+# Playback position
+run_index = 0
+run_left  = 0
+
+def rom_crc():
+  return zlib.crc32(loader.data)
+
+def start_recording(movie_path):
+  global mode, path, runs, frame
+
+  mode = 'record'
+  path = movie_path
+  runs = []
+  frame = 0
+
+# Called once per frame, after the controllers are polled
+def record(ports):
+  global frame
+
+  frame += 1
+  if runs and runs[-1][0] < MAX_RUN and runs[-1][1] == ports[0] and runs[-1][2] == ports[1]:
+    runs[-1][0] += 1
+  else:
+    runs.append([1, ports[0], ports[1]])
+
+def start_playback(movie_path):
+  global mode, path, runs, frame, run_index, run_left
+
+  with open(movie_path, 'rb') as movie:
+    magic, version, crc, frames = HEADER.unpack(movie.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+      raise ValueError('%s is not a movie' % movie_path)
+    if crc != rom_crc():
+      raise ValueError('%s was recorded with another ROM' % movie_path)
+
+    data = movie.read()
+
+  mode = 'play'
+  path = movie_path
+  runs = [list(run) for run in RUN.iter_unpack(data)]
+  frame = 0
+  run_index = 0
+  run_left = runs[0][0] if runs else 0
+
+# Sets the ports for the next frame, returns False at the end of the movie
+def play():
+  global frame, run_index, run_left
+
+  if run_left == 0:
+    return False
+
+  count, port1, port2 = runs[run_index]
+  controller.ports[0] = port1
+  controller.ports[1] = port2
+
+  frame += 1
+  run_left -= 1
+  if run_left == 0 and run_index + 1 < len(runs):
+    run_index += 1
+    run_left = runs[run_index][0]
+
+  return True
+
+# Writes the recorded movie
+def stop():
+  global mode
+
+  if mode == 'record':
+    with open(path, 'wb') as movie:
+      movie.write(HEADER.pack(MAGIC, VERSION, rom_crc(), frame))
+      for run in runs:
+        movie.write(RUN.pack(*run))
+
+  mode = None
@@ -0,0 +1,144 @@
+import time
+import apu
+import audio
+import shared
+import config
+
+# Frame Pacing
+#
+# 'audio' - The audio device clock paces emulation. After each frame the
+#           emulator sleeps until the ring buffer is back at the target
+#           latency, and the APU resampling ratio is nudged by up to
+#           MAX_RATE_ADJUST so the buffer neither drains nor grows. The
+#           pitch change is inaudible and no time is spent busy-waiting.
+# 'wall'  - Each frame has a deadline on the perf_counter() clock, the
+#           emulator sleeps until it. speed multiplies the frame rate
+#           (fast-forward above 1, slow motion below).
+# 'none'  - No pacing (turbo), frames run as fast as possible.
+mode = 'audio'
+
+# Target audio latency, in seconds of samples waiting in the ring buffer
+latency = 0.05
+
+MAX_RATE_ADJUST = 0.005
+
+# Current resampling ratio, 1.0 is the nominal rate
+rate_adjust = 1.0
+
+speed = 1.0
+
+# perf_counter() time the current frame has to be finished by
+deadline = 0.0
+
+# time.sleep() can wake up late, the last SPIN_TIME seconds before a
+# deadline are waited with sleep(0), which only yields
+SPIN_TIME = 0.001
+
+# Deadlines further behind than this are given up on, instead of running
+# frames unpaced until the time is made up
+MAX_LATE = 0.25
+
+# Frame Skipping
+#
+# When a frame starts after its deadline (or the audio buffer is running
+# dry) the emulator is behind, and the frame is run without PPU pixel
+# output or presentation, up to max_skip frames in a row.
+max_skip = 2
+
+# Frames skipped in a row and since start
+consecutive_skips = 0
+skipped_frames    = 0
+
+def initialize(pacing_mode='audio', target_latency=0.05, speed_multiplier=1.0, max_frame_skip=2):
+  global mode, latency, rate_adjust, speed, deadline, max_skip, consecutive_skips, skipped_frames
+
+  mode = pacing_mode
+  latency = target_latency
+  rate_adjust = 1.0
+  speed = speed_multiplier
+
+  max_skip = max_frame_skip
+  consecutive_skips = 0
+  skipped_frames = 0
+
+  # The audio clock can only run at normal speed
+  if mode == 'audio' and speed != 1.0:
+    mode = 'wall'
+
+  deadline = time.perf_counter()
+
+def target_fill():
+  return latency * apu.SAMPLE_RATE
+
+# Samples waiting to be played, with the core in its own process they are
+# in the front-end
+def queued():
+  return shared.device_fill() if shared.attached else audio.fill()
+
+# Called before the APU builds the samples of a frame. Below the target
+# more samples are made for the same CPU cycles, above it fewer.
+def adjust_audio_rate():
+  global rate_adjust
+
+  if mode != 'audio':
+    return
+
+  target = target_fill()
+  deviation = (target - queued()) / target
+  rate_adjust = 1.0 + max(-1.0, min(1.0, deviation)) * MAX_RATE_ADJUST
+
+  apu.cycle_rate = apu.SAMPLE_RATE / config.cpu_clock * rate_adjust
+
+# Called before a frame is run, True if its output should be skipped
+def should_skip():
+  global consecutive_skips, skipped_frames
+
+  if mode == 'audio':
+    behind = queued() < target_fill() / 2
+  elif mode == 'wall':
+    # deadline is the one wait_deadline() just waited for, the frame
+    # about to run is due a period later
+    behind = time.perf_counter() > deadline + period()
+  else:
+    behind = False
+
+  if behind and consecutive_skips < max_skip:
+    consecutive_skips += 1
+    skipped_frames += 1
+    return True
+
+  consecutive_skips = 0
+  return False
+
+# Called after a frame is finished
+def wait():
+  if mode == 'audio':
+    wait_audio()
+  elif mode == 'wall':
+    wait_deadline()
+
+def wait_audio():
+  # Sleeps while the samples above the target are played
+  excess = queued() - target_fill()
+  if excess > 0:
+    time.sleep(excess / apu.SAMPLE_RATE)
+
+# Seconds per frame on the wall clock
+def period():
+  return 1.0 / (config.frame_rate * speed)
+
+def wait_deadline():
+  global deadline
+
+  deadline += period()
+
+  now = time.perf_counter()
+  if now - deadline > MAX_LATE:
+    deadline = now
+    return
+
+  remaining = deadline - now
+  if remaining > SPIN_TIME:
+    time.sleep(remaining - SPIN_TIME)
+  while time.perf_counter() < deadline:
+    time.sleep(0)
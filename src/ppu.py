@@ -1,4 +1,6 @@
 import memory as mem
+import cpu
+import config
 
 colour_palette = [
     (0x75, 0x75, 0x75), # 0x00
@@ -71,26 +73,93 @@ colour_palette = [
 ]
 
 
-#  PPU Visual Ram
+#  PPU Address Space
 #
-#  +----------------+ 0x10000
-#  |    Mirrors     |
-#  | 0x0000-0x3FFF  |
-#  +----------------| 0x4000
+#  +----------------+ 0x4000
 #  |    Mirrors     |
 #  | 0x3F00-0x3F1F  |
 #  |- - - - - - - - | 0x3F20
 #  | Sprite Palette |
 #  |- - - - - - - - | 0x3F10
-#  |  Image Pallete |
+#  |  Image Pallete |  palette_ram   - 32 bytes
 #  +----------------+ 0x3F00
-#  |  Name Tables   |
+#  |    Mirrors     |
+#  | 0x2000-0x2EFF  |
+#  |- - - - - - - - | 0x3000
+#  |  Name Tables   |  nametable_ram - 2KB, mirrored through nametable_map
 #  +----------------+ 0x2000
-#  | Pattern Tables |
+#  | Pattern Tables |  pattern_tables - CHR-ROM view or 8KB of CHR-RAM
 #  +----------------+ 0x0000
 #
+#  The 0x4000-0xFFFF range mirrors 0x0000-0x3FFF, every address is masked
+#  with 0x3FFF before the lookup.
+#
+
+# Nametable mirroring, header byte 6
+HORIZONTAL  = 0
+VERTICAL    = 1
+FOUR_SCREEN = 2
+
+nametable_ram  = bytearray(0x800)
+palette_ram    = bytearray(0x20)
+pattern_tables = bytearray(0x2000)
+
+# CHR-RAM cartridges (no CHR-ROM) can write to the pattern tables
+chr_writable = True
+
+mirroring = HORIZONTAL
+
+# Physical nametable (1KB page of nametable_ram) used by each of the four
+# logical nametables, and the logical nametables that show each page
+nametable_pages   = [0, 0, 1, 1]
+nametable_mirrors = [[0, 1], [2, 3], [], []]
+
+# Translates (address & 0x0FFF) of a nametable access into a nametable_ram
+# index, built by set_mirroring()
+nametable_map = None
+
+# 0x3F10, 0x3F14, 0x3F18 and 0x3F1C mirror 0x3F00, 0x3F04, 0x3F08 and 0x3F0C
+palette_map = [i & 0x0F if i & 0x13 == 0x10 else i for i in range(0x20)]
+
+def set_mirroring(mode):
+  global mirroring, nametable_ram, nametable_map, nametable_pages, nametable_mirrors
+
+  mirroring = mode
+
+  #  Horizontal    Vertical     Four Screen
+  #  +---+---+    +---+---+    +---+---+
+  #  | A | A |    | A | B |    | A | B |
+  #  +---+---+    +---+---+    +---+---+
+  #  | B | B |    | A | B |    | C | D |
+  #  +---+---+    +---+---+    +---+---+
+  if mode == VERTICAL:
+    nametable_pages = [0, 1, 0, 1]
+  elif mode == FOUR_SCREEN:
+    nametable_pages = [0, 1, 2, 3]
+  else:
+    nametable_pages = [0, 0, 1, 1]
+
+  pages = 4 if mode == FOUR_SCREEN else 2
+  if len(nametable_ram) != pages * 0x400:
+    nametable_ram = bytearray(pages * 0x400)
 
-vram = [0] * 0x10000
+  nametable_map = [(nametable_pages[a >> 10] << 10) | (a & 0x3FF) for a in range(0x1000)]
+  nametable_mirrors = [[n for n in range(4) if nametable_pages[n] == p] for p in range(4)]
+
+  mark_all_dirty()
+
+def load_chr(view):
+  global pattern_tables, chr_writable
+
+  # No CHR-ROM means the cartridge has 8KB of CHR-RAM
+  if len(view) == 0:
+    pattern_tables = bytearray(0x2000)
+    chr_writable = True
+  else:
+    pattern_tables = view[:0x2000]
+    chr_writable = False
+
+  mark_all_dirty()
 
 PPUCTRL   = 0
 PPUMASK   = 0
@@ -102,22 +171,499 @@ PPUADDR   = 0
 PPUDATA   = 0
 OAMDMA    = 0
 
+# Internal registers
+#
+# vram_address - Address used by PPUDATA, set with two writes to PPUADDR
+# scroll_x     - First write to PPUSCROLL
+# scroll_y     - Second write to PPUSCROLL
+# write_toggle - PPUSCROLL and PPUADDR share the same first/second write latch
+vram_address = 0
+scroll_x     = 0
+scroll_y     = 0
+write_toggle = 0
+read_buffer  = 0
+
+# Object Attribute Memory, 64 sprites of 4 bytes
+#
+# 0 - Y position - 1
+# 1 - Tile index
+# 2 - Attributes
+# 3 - X position
+oam = bytearray(0x100)
+
+#  Frame Timing
+#
+#  The PPU draws 341 dots per scanline and 262 scanlines per frame, three
+#  dots for every CPU cycle.
+#
+#  +----------------+ 0
+#  |    Visible     |
+#  |   Scanlines    |
+#  +----------------+ 240
+#  |  Post-Render   |
+#  +----------------+ 241 <-- Vertical blank starts (dot 1), NMI
+#  | Vertical Blank |
+#  +----------------+ 261 <-- Pre-render, flags are cleared (dot 1)
+#
+#  The PPU is not stepped with the CPU. It remembers the CPU cycle it was
+#  last synchronised at and catches up in bulk when the CPU reads or
+#  writes one of its registers, or when the CPU reaches next_event.
+#
+#  The layout above is NTSC, PAL and Dendy have 312 scanlines (Dendy starts
+#  vertical blank at 291) and PAL runs 3.2 dots per CPU cycle. The timing
+#  below is set from config by set_timing(), dots per CPU cycle are kept
+#  as a fraction so catching up is exact integer math for every region.
+#
+DOTS_PER_SCANLINE = 341
+SCANLINES         = 262
+CYCLE_DOTS        = 3
+CYCLE_DIVISOR     = 1
+ODD_FRAME_SKIP    = True
+
+FRAME_DOTS     = DOTS_PER_SCANLINE * SCANLINES
+VBLANK_DOT     = DOTS_PER_SCANLINE * 241 + 1
+PRE_RENDER_DOT = DOTS_PER_SCANLINE * 261 + 1
+
+# Dot of the current frame, CPU cycle of the last synchronisation and the
+# CPU cycle of the next event that needs to be handled
+dot         = 0
+last_sync   = 0
+next_event  = VBLANK_DOT // CYCLE_DOTS + 1
+
+frame_count = 0
+
+# Length of the current frame, on NTSC with rendering enabled odd frames
+# skip the last dot of the pre-render scanline (29780.5 CPU cycles on
+# average)
+frame_length = FRAME_DOTS
+
+# Set when a frame is finished, cleared by whoever consumes the frame
+frame_ready = False
+
+# Pixel output, when off frames are skipped: timing, flags and NMI are
+# kept but no frame is built and frame keeps the last one. Nametable
+# writes still mark tiles dirty, so the next rendered frame is correct.
+render_enabled = True
+
+#  Nametable Canvas
+#
+#  The four nametables are kept pre-rendered in a 512x480 canvas, one byte
+#  per pixel. Each byte holds the palette RAM offset of the pixel
+#  (attribute << 2 | pattern), the colour is only looked up when the frame
+#  is built, so palette changes never dirty the canvas.
+#
+#  +---------+---------+ 
+#  |  0x2000 |  0x2400 |
+#  +---------+---------+ 480
+#  |  0x2800 |  0x2C00 |
+#  +---------+---------+
+#           512
+#
+CANVAS_WIDTH  = 512
+CANVAS_HEIGHT = 480
+
+canvas = bytearray(CANVAS_WIDTH * CANVAS_HEIGHT)
+
+# Dirty bitmaps, one byte per tile (960) and per attribute byte (64) of
+# each nametable. nametable_dirty tells if a nametable has any dirty entry.
+tile_dirty      = [bytearray(b'\x01' * 960) for _ in range(4)]
+attribute_dirty = [bytearray(64) for _ in range(4)]
+nametable_dirty = [True] * 4
+
+# Finished frame, 256x240 colour indexes (0x00-0x3F) of colour_palette
+frame = bytearray(256 * 240)
+
+# Spreads the 8 bits of a pattern byte into 8 bytes, bit 7 goes to the
+# first byte (leftmost pixel), e.g. 0b10000001 -> 0x0100000000000001.
+# Built by the first update_canvas() rather than at import.
+bit_spread = None
+
 
 def initialize():
-  global vram
-
-  vram = [0] * 0x10000
-
-def cycle():
-  # Read the PPU Control Register 1
-
-  # Read The PPU COntrol Register 2
-  print('PPU CTRL:   ', bin(mem.memory[0x2000]))
-  print('PPU MASK:   ', bin(mem.memory[0x2001]))
-  print('PPU STATUS: ', bin(mem.memory[0x2002]))
-  print('OAMADDR:    ', bin(mem.memory[0x2003]))
-  print('OAMADATA:   ', bin(mem.memory[0x2004]))
-  print('PPUSCROLL:  ', bin(mem.memory[0x2005]))
-  print('PPUADDR:    ', bin(mem.memory[0x2006]))
-  print('PPUDATA:    ', bin(mem.memory[0x2007]))
-  print('OAMDMA:     ', bin(mem.memory[0x4014]))
+  global nametable_ram, palette_ram, oam, vram_address, scroll_x, scroll_y, write_toggle
+  global read_buffer, dot, last_sync, frame_count, frame_length, frame_ready, frame
+
+  set_timing()
+
+  if nametable_map is None:
+    set_mirroring(mirroring)
+
+  nametable_ram = bytearray(len(nametable_ram))
+  palette_ram   = bytearray(0x20)
+  oam           = bytearray(0x100)
+
+  vram_address = 0
+  scroll_x     = 0
+  scroll_y     = 0
+  write_toggle = 0
+  read_buffer  = 0
+
+  dot          = 0
+  last_sync    = cpu.cycles
+  frame_count  = 0
+  frame_length = FRAME_DOTS
+  frame_ready  = False
+  schedule()
+
+  frame = bytearray(256 * 240)
+  mark_all_dirty()
+
+## Timing
+
+# Frame layout and clock ratio of the region in config
+def set_timing():
+  global SCANLINES, CYCLE_DOTS, CYCLE_DIVISOR, ODD_FRAME_SKIP, FRAME_DOTS, VBLANK_DOT
+  global PRE_RENDER_DOT
+
+  SCANLINES      = config.scanlines
+  CYCLE_DOTS     = config.cycle_dots
+  CYCLE_DIVISOR  = config.cycle_divisor
+  ODD_FRAME_SKIP = config.odd_frame_skip
+
+  FRAME_DOTS     = DOTS_PER_SCANLINE * SCANLINES
+  VBLANK_DOT     = DOTS_PER_SCANLINE * config.vblank_scanline + 1
+  PRE_RENDER_DOT = DOTS_PER_SCANLINE * (SCANLINES - 1) + 1
+
+# Dots run by the PPU from power up to a CPU cycle
+def cycle_to_dots(cycle):
+  return cycle * CYCLE_DOTS // CYCLE_DIVISOR
+
+# Runs the PPU up to the current CPU cycle
+def catch_up():
+  global last_sync
+
+  # advance() schedules the next event from last_sync, it has to be the
+  # cycle the PPU is run up to
+  target = cpu.cycles
+  if target > last_sync:
+    dots = cycle_to_dots(target) - cycle_to_dots(last_sync)
+    last_sync = target
+    advance(dots)
+
+# Runs the PPU forward, stopping only at the dots where something happens
+def advance(dots):
+  global dot, frame_count, frame_length, PPUSTATUS
+
+  while dots:
+    event = next_event_dot()
+    if dot + dots < event:
+      dot += dots
+      break
+
+    dots -= event - dot
+    dot = event
+
+    if dot == sprite_zero_dot():
+      PPUSTATUS |= 0b0100_0000
+    elif dot == VBLANK_DOT:
+      start_vblank()
+    elif dot == PRE_RENDER_DOT:
+      # Clears vertical blank and sprite 0 hit
+      PPUSTATUS &= 0b0011_1111
+      if ODD_FRAME_SKIP and frame_count & 0x1 and PPUMASK & 0b0001_1000:
+        frame_length = FRAME_DOTS - 1
+    elif dot == frame_length:
+      dot = 0
+      frame_count += 1
+      frame_length = FRAME_DOTS
+
+  schedule()
+
+def start_vblank():
+  global PPUSTATUS, frame_ready
+
+  if render_enabled:
+    render_frame()
+    frame_ready = True
+
+  PPUSTATUS |= 0b1000_0000
+  if PPUCTRL & 0b1000_0000:
+    cpu.nmi_pending = True
+
+# Next dot, after the current one, with an event
+def next_event_dot():
+  sprite_zero = sprite_zero_dot()
+  if dot < sprite_zero:
+    return sprite_zero
+  elif dot < VBLANK_DOT:
+    return VBLANK_DOT
+  elif dot < PRE_RENDER_DOT:
+    return PRE_RENDER_DOT
+  return frame_length
+
+# Sprite 0 hit, approximated to the first dot sprite 0 is drawn when both
+# background and sprites are enabled
+def sprite_zero_dot():
+  if PPUMASK & 0b0001_1000 != 0b0001_1000 or oam[0] >= 239:
+    return -1
+  return (oam[0] + 1) * DOTS_PER_SCANLINE + oam[3] + 1
+
+# CPU cycle the CPU must reach before the PPU has to run again. Sprite 0
+# hit is only seen through PPUSTATUS reads, which catch up on their own.
+def schedule():
+  global next_event
+
+  # First cycle whose dot count reaches the event, rounded up
+  event = VBLANK_DOT if dot < VBLANK_DOT else frame_length
+  dots  = cycle_to_dots(last_sync) + event - dot
+  next_event = -(-dots * CYCLE_DIVISOR // CYCLE_DOTS)
+
+## Registers
+
+# CPU reads from 0x2000-0x2007
+def read_register(address):
+  global PPUSTATUS, OAMADDR, vram_address, write_toggle, read_buffer
+
+  catch_up()
+
+  register = address & 0x7
+
+  if register == 0x2: # PPUSTATUS
+    # Reading clears vertical blank and the write latch
+    value = PPUSTATUS
+    PPUSTATUS &= 0b0111_1111
+    write_toggle = 0
+    return value
+  elif register == 0x4: # OAMDATA
+    return oam[OAMADDR]
+  elif register == 0x7: # PPUDATA
+    # Reads are delayed by one, except for the palettes
+    value = read_buffer
+    read_buffer = read_vram(vram_address)
+    if (vram_address & 0x3FFF) >= 0x3F00:
+      value = read_buffer
+      read_buffer = read_vram(vram_address - 0x1000)
+    vram_address = (vram_address + (32 if PPUCTRL & 0b0000_0100 else 1)) & 0x3FFF
+    return value
+
+  # Write only registers
+  return 0
+
+# CPU writes to 0x2000-0x2007
+def write_register(address, value):
+  global PPUCTRL, PPUMASK, OAMADDR, PPUSCROLL, PPUADDR, PPUDATA
+  global vram_address, scroll_x, scroll_y, write_toggle
+
+  catch_up()
+
+  register = address & 0x7
+
+  if register == 0x0: # PPUCTRL
+    # Bit 4 selects the background pattern table
+    if (PPUCTRL ^ value) & 0b0001_0000:
+      mark_all_dirty()
+    # Enabling NMI during vertical blank fires it right away
+    if value & ~PPUCTRL & 0b1000_0000 and PPUSTATUS & 0b1000_0000:
+      cpu.nmi_pending = True
+    PPUCTRL = value
+  elif register == 0x1: # PPUMASK
+    PPUMASK = value
+    schedule()
+  elif register == 0x3: # OAMADDR
+    OAMADDR = value
+  elif register == 0x4: # OAMDATA
+    oam[OAMADDR] = value
+    OAMADDR = (OAMADDR + 1) & 0xFF
+  elif register == 0x5: # PPUSCROLL
+    PPUSCROLL = value
+    if write_toggle == 0:
+      scroll_x = value
+    else:
+      scroll_y = value
+    write_toggle ^= 1
+  elif register == 0x6: # PPUADDR
+    PPUADDR = value
+    if write_toggle == 0:
+      vram_address = ((value & 0x3F) << 8) | (vram_address & 0x00FF)
+    else:
+      vram_address = (vram_address & 0xFF00) | value
+    write_toggle ^= 1
+  elif register == 0x7: # PPUDATA
+    PPUDATA = value
+    write_vram(vram_address, value)
+    # Bit 2 of PPUCTRL, increment by 32 (going down) or by 1 (going across)
+    vram_address = (vram_address + (32 if PPUCTRL & 0b0000_0100 else 1)) & 0x3FFF
+
+# OAMDMA - Copies the CPU page value * 0x100 into OAM, the CPU is
+# suspended for 513 cycles
+def write_dma(value):
+  global OAMDMA
+
+  catch_up()
+
+  OAMDMA = value
+  page = value << 8
+  oam[:] = mem.memory[page:page + 0x100]
+  cpu.cycles += 513
+
+def read_vram(address):
+  address &= 0x3FFF
+
+  if address < 0x2000:
+    return pattern_tables[address]
+  elif address < 0x3F00:
+    return nametable_ram[nametable_map[address & 0x0FFF]]
+  else:
+    return palette_ram[palette_map[address & 0x1F]]
+
+def write_vram(address, value):
+  address &= 0x3FFF
+
+  if address < 0x2000:
+    if chr_writable and pattern_tables[address] != value:
+      pattern_tables[address] = value
+      # Pattern tables, any tile may use it
+      mark_all_dirty()
+  elif address < 0x3F00:
+    index = nametable_map[address & 0x0FFF]
+    if nametable_ram[index] == value:
+      return
+
+    nametable_ram[index] = value
+
+    offset = index & 0x3FF
+    for nametable in nametable_mirrors[index >> 10]:
+      if offset < 0x3C0:
+        tile_dirty[nametable][offset] = 1
+      else:
+        attribute_dirty[nametable][offset - 0x3C0] = 1
+      nametable_dirty[nametable] = True
+  else:
+    palette_ram[palette_map[address & 0x1F]] = value
+
+# Replaces the nametable RAM (save states), only the entries that change
+# are marked dirty so the canvas is not rebuilt after every state load
+def load_nametables(data):
+  if nametable_ram == data:
+    return
+
+  for start in range(0, len(nametable_ram), 32):
+    row = data[start:start + 32]
+    if nametable_ram[start:start + 32] == row:
+      continue
+
+    for index in range(start, start + 32):
+      if nametable_ram[index] != row[index - start]:
+        offset = index & 0x3FF
+        for nametable in nametable_mirrors[index >> 10]:
+          if offset < 0x3C0:
+            tile_dirty[nametable][offset] = 1
+          else:
+            attribute_dirty[nametable][offset - 0x3C0] = 1
+          nametable_dirty[nametable] = True
+
+    nametable_ram[start:start + 32] = row
+
+def mark_all_dirty():
+  for nametable in range(4):
+    tile_dirty[nametable][:] = b'\x01' * 960
+    nametable_dirty[nametable] = True
+
+## Background Rendering
+
+# Re-renders the dirty tiles of the canvas
+def update_canvas():
+  global bit_spread
+
+  if bit_spread is None:
+    bit_spread = [
+      sum(((b >> (7 - i)) & 1) << (8 * (7 - i)) for i in range(8)) for b in range(0x100)
+    ]
+
+  for nametable in range(4):
+    if not nametable_dirty[nametable]:
+      continue
+
+    tiles = tile_dirty[nametable]
+    attributes = attribute_dirty[nametable]
+
+    # An attribute byte covers 4x4 tiles
+    i = attributes.find(1)
+    while i != -1:
+      attributes[i] = 0
+      row = (i >> 3) << 2
+      column = (i & 0x7) << 2
+      for r in range(row, min(row + 4, 30)):
+        tiles[r * 32 + column:r * 32 + column + 4] = b'\x01\x01\x01\x01'
+      i = attributes.find(1, i + 1)
+
+    i = tiles.find(1)
+    while i != -1:
+      tiles[i] = 0
+      render_tile(nametable, i)
+      i = tiles.find(1, i + 1)
+
+    nametable_dirty[nametable] = False
+
+def render_tile(nametable, tile):
+  base = nametable_pages[nametable] << 10
+  row = tile >> 5
+  column = tile & 0x1F
+
+  # Attribute byte, 2 bits for each 2x2 tiles block
+  #
+  # +-+-+-+-+-+-+-+-+
+  # |BR |BL |TR |TL |
+  # +-+-+-+-+-+-+-+-+
+  #  7 6 5 4 3 2 1 0
+  attribute = nametable_ram[base + 0x3C0 + ((row >> 2) << 3) + (column >> 2)]
+  shift = ((row & 0x2) << 1) | (column & 0x2)
+  palette = ((attribute >> shift) & 0x3) * 0x0404040404040404
+
+  pattern = ((PPUCTRL & 0b0001_0000) << 8) + (nametable_ram[base + tile] << 4)
+
+  offset = (nametable >> 1) * 240 * CANVAS_WIDTH + (nametable & 0x1) * 256
+  offset += row * 8 * CANVAS_WIDTH + column * 8
+
+  for y in range(8):
+    low  = bit_spread[pattern_tables[pattern + y]]
+    high = bit_spread[pattern_tables[pattern + y + 8]]
+    pixels = low | (high << 1)
+    # Pixel 0 is transparent and always uses the backdrop colour
+    canvas[offset:offset + 8] = (pixels | palette).to_bytes(8, 'big')
+    offset += CANVAS_WIDTH
+
+# Builds the frame from a scrolled 256x240 window of the canvas
+def render_frame():
+  global frame
+
+  # Background disabled, only the backdrop colour is shown
+  if not PPUMASK & 0b0000_1000:
+    frame = bytearray([palette_ram[0] & 0x3F]) * (256 * 240)
+    return
+
+  update_canvas()
+
+  x = scroll_x + (PPUCTRL & 0x1) * 256
+  y = scroll_y + ((PPUCTRL >> 1) & 0x1) * 240
+
+  window = bytearray(256 * 240)
+  for row in range(240):
+    start = ((y + row) % CANVAS_HEIGHT) * CANVAS_WIDTH
+    if x <= CANVAS_WIDTH - 256:
+      window[row * 256:row * 256 + 256] = canvas[start + x:start + x + 256]
+    else:
+      split = CANVAS_WIDTH - x
+      window[row * 256:row * 256 + split] = canvas[start + x:start + CANVAS_WIDTH]
+      window[row * 256 + split:row * 256 + 256] = canvas[start:start + 256 - split]
+
+  frame = window.translate(palette_table())
+
+# Maps a canvas byte to a colour index
+def palette_table():
+  table = bytearray(256)
+  for i in range(16):
+    table[i] = palette_ram[i if i & 0x3 else 0] & 0x3F
+  return bytes(table)
+
+# Debug
+def debug():
+  print('PPU CTRL:   ', bin(PPUCTRL))
+  print('PPU MASK:   ', bin(PPUMASK))
+  print('PPU STATUS: ', bin(PPUSTATUS))
+  print('OAMADDR:    ', bin(OAMADDR))
+  print('PPUSCROLL:  ', bin(PPUSCROLL))
+  print('PPUADDR:    ', bin(PPUADDR))
+  print('PPUDATA:    ', bin(PPUDATA))
+  print('OAMDMA:     ', bin(OAMDMA))
+  print('SCANLINE:   ', dot // DOTS_PER_SCANLINE)
@@ -0,0 +1,175 @@
+import sys
+import queue
+import struct
+import threading
+import zlib
+
+# Video Recorder
+#
+# Finished frames are put in a bounded queue and written by a worker
+# thread, the emulation thread never compresses or writes anything. When
+# the queue is full the frame is dropped and counted.
+#
+# Formats
+#
+# NESV - Raw frame container, colour indexes compressed with zlib
+#
+#   +----------------+
+#   | 'NESV'         | 4 bytes
+#   | Version        | 1 byte
+#   | Width, Height  | 2 + 2 bytes, little endian
+#   | Frame rate     | 4 bytes, float, little endian
+#   +----------------+
+#   | Size           | 4 bytes, little endian  \
+#   | zlib(frame)    | Size bytes              / repeated for each frame
+#   +----------------+
+#
+# Y4M  - YUV4MPEG2, 4:4:4 planes, readable by most video tools
+#
+NESV_MAGIC   = b'NESV'
+NESV_VERSION = 1
+NESV_HEADER  = struct.Struct('<4sBHHf')
+NESV_FRAME   = struct.Struct('<I')
+
+WIDTH  = 256
+HEIGHT = 240
+
+# Stops the worker
+STOP = None
+
+recording = False
+frames    = None
+worker    = None
+
+# Frames dropped because the writer fell behind, and frames written
+dropped = 0
+written = 0
+
+# Exception the writer stopped on (disk full, ...), None while it runs
+error = None
+
+def start(path, format='nesv', fps=60.0, max_frames=120):
+  global recording, frames, worker, dropped, written, error
+
+  output = open(path, 'wb')
+
+  frames  = queue.Queue(max_frames)
+  dropped = 0
+  written = 0
+  error = None
+
+  if format == 'y4m':
+    target = write_y4m
+  else:
+    target = write_nesv
+
+  worker = threading.Thread(target=run_writer, args=(target, output, fps), name='recorder', daemon=True)
+  worker.start()
+
+  recording = True
+
+# Queues a finished frame, the PPU never writes to it again
+def push(frame):
+  global dropped
+
+  try:
+    frames.put_nowait(frame)
+  except queue.Full:
+    dropped += 1
+
+# Waits for the queued frames to be written. A writer that died leaves
+# the queue full, STOP is only put while it still runs.
+def stop():
+  global recording
+
+  if not recording:
+    return
+
+  recording = False
+  while worker.is_alive():
+    try:
+      frames.put(STOP, timeout=0.1)
+      break
+    except queue.Full:
+      pass
+  worker.join()
+
+  if error is not None:
+    print('recording stopped after %d frames: %s' % (written, error), file=sys.stderr)
+
+# Runs a writer, keeping the exception it stops on for stop() to report
+def run_writer(target, output, fps):
+  global error
+
+  try:
+    target(output, fps)
+  except Exception as exception:
+    error = exception
+
+## Writers
+
+def write_nesv(output, fps):
+  global written
+
+  with output:
+    output.write(NESV_HEADER.pack(NESV_MAGIC, NESV_VERSION, WIDTH, HEIGHT, fps))
+
+    while True:
+      frame = frames.get()
+      if frame is STOP:
+        break
+
+      data = zlib.compress(frame, 1)
+      output.write(NESV_FRAME.pack(len(data)))
+      output.write(data)
+      written += 1
+
+def write_y4m(output, fps):
+  global written
+
+  y_table, u_table, v_table = yuv_tables()
+
+  with output:
+    numerator, denominator = round(fps * 1000), 1000
+    output.write(b'YUV4MPEG2 W%d H%d F%d:%d Ip A1:1 C444\n' % (WIDTH, HEIGHT, numerator, denominator))
+
+    while True:
+      frame = frames.get()
+      if frame is STOP:
+        break
+
+      output.write(b'FRAME\n')
+      output.write(frame.translate(y_table))
+      output.write(frame.translate(u_table))
+      output.write(frame.translate(v_table))
+      written += 1
+
+# Maps each colour index to its BT.601 Y, Cb and Cr values
+def yuv_tables():
+  import ppu
+
+  y_table = bytearray(256)
+  u_table = bytearray(256)
+  v_table = bytearray(256)
+
+  for i, (r, g, b) in enumerate(ppu.colour_palette):
+    y_table[i] = round( 16 + ( 65.738 * r + 129.057 * g +  25.064 * b) / 256)
+    u_table[i] = round(128 + (-37.945 * r -  74.494 * g + 112.439 * b) / 256)
+    v_table[i] = round(128 + (112.439 * r -  94.154 * g -  18.285 * b) / 256)
+
+  return bytes(y_table), bytes(u_table), bytes(v_table)
+
+## Reader
+
+# Yields the colour indexes of each frame of a NESV file
+def read_nesv(path):
+  with open(path, 'rb') as recording:
+    magic, version, width, height, fps = NESV_HEADER.unpack(recording.read(NESV_HEADER.size))
+    if magic != NESV_MAGIC or version != NESV_VERSION:
+      raise ValueError('%s is not a NESV recording' % path)
+
+    while True:
+      size = recording.read(NESV_FRAME.size)
+      if len(size) < NESV_FRAME.size:
+        break
+      yield zlib.decompress(recording.read(NESV_FRAME.unpack(size)[0]))
@@ -0,0 +1,121 @@
+import zlib
+import collections
+import savestate
+
+# Rewind Buffer
+#
+# A save state is taken every interval frames. Every keyframe_every-th one
+# is a keyframe, stored whole, the ones in between are stored as the XOR
+# with the keyframe before them. Most of the machine does not change in a
+# few frames, so the XOR is mostly zeros and zlib shrinks it to a few KB.
+#
+#   oldest                                                       newest
+#  +-----+-----+-----+-----+-----+-----+-----+-----+
+#  | K   | d   | d   | d   | K   | d   | d   | d   |   d = state ^ K
+#  +-----+-----+-----+-----+-----+-----+-----+-----+
+#  \______ group ________/  \______ group ________/
+#
+# Restoring any snapshot takes one keyframe and at most one delta, so the
+# latency does not grow with the buffer. When the buffer goes over budget
+# the oldest group is dropped as a whole, its deltas need its keyframe.
+enabled = False
+
+interval       = 4
+keyframe_every = 32
+budget         = 16 << 20
+
+# Groups of [keyframe, delta, ...], compressed
+groups = collections.deque()
+
+# Keyframe of the newest group, uncompressed
+keyframe = b''
+
+# Compressed bytes held and frames since the last snapshot
+size   = 0
+frames = 0
+
+# Snapshots dropped to stay within the budget
+evicted = 0
+
+def initialize(snapshot_interval=4, budget_mb=16, keyframe_interval=32):
+  global enabled, interval, keyframe_every, budget, groups, keyframe, size, frames, evicted
+
+  enabled = True
+  interval = snapshot_interval
+  keyframe_every = keyframe_interval
+  budget = int(budget_mb * (1 << 20))
+
+  groups = collections.deque()
+  keyframe = b''
+  size = 0
+  frames = 0
+  evicted = 0
+
+# Called after every frame
+def push():
+  global frames
+
+  frames += 1
+  if frames < interval:
+    return
+  frames = 0
+
+  snapshot()
+
+def snapshot():
+  global keyframe, size
+
+  state = savestate.save()
+
+  if not groups or len(groups[-1]) >= keyframe_every or len(state) != len(keyframe):
+    keyframe = state
+    entry = zlib.compress(state, 1)
+    groups.append([entry])
+  else:
+    entry = zlib.compress(xor(state, keyframe), 1)
+    groups[-1].append(entry)
+  size += len(entry)
+
+  # The newest group is never dropped
+  while size > budget and len(groups) > 1:
+    evict()
+
+def evict():
+  global size, evicted
+
+  group = groups.popleft()
+  size -= sum(len(entry) for entry in group)
+  evicted += len(group)
+
+def xor(a, b):
+  return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+
+# Snapshots held
+def count():
+  return sum(len(group) for group in groups)
+
+# Goes back steps snapshots and loads the one reached, the snapshots after
+# it are dropped. Returns False when there is nothing to go back to.
+def rewind(steps=1):
+  global keyframe, size, frames
+
+  for _ in range(steps):
+    if count() <= 1:
+      break
+    group = groups[-1]
+    size -= len(group.pop())
+    if not group:
+      groups.pop()
+
+  if not groups:
+    return False
+
+  group = groups[-1]
+  keyframe = zlib.decompress(group[0])
+  state = keyframe
+  if len(group) > 1:
+    state = xor(zlib.decompress(group[-1]), keyframe)
+
+  savestate.load(state)
+  frames = 0
+  return True
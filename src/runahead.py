@@ -0,0 +1,68 @@
+import time
+import ppu
+import savestate
+
+# Run-Ahead
+#
+# Games usually react to input a frame or two after it is read. With
+# run-ahead the real frame is run without pixel output, its state is
+# saved, frames more frames are run with the same input and only the last
+# one is rendered, then the state is loaded back. The frame shown is the
+# one the game would show frames frames later, the input lag is hidden.
+#
+#   real frame       saved         ahead 1 .. frames        loaded
+#  +-----------+   +-------+   +-----+-----+---------+   +-------+
+#  | no pixels | > | state | > |     |     | render  | > | state |
+#  +-----------+   +-------+   +-----+-----+---------+   +-------+
+#
+# Audio comes from the real frame only, the samples of the frames run
+# ahead are dropped when the state is loaded.
+
+# Frames run ahead, 0 is off
+frames = 0
+
+# Time spent on run-ahead, in total and split into save/load and the
+# frames run ahead, and frames it was done for
+total_time = 0.0
+state_time = 0.0
+ahead_time = 0.0
+count      = 0
+
+def initialize(ahead_frames=0):
+  global frames, total_time, state_time, ahead_time, count
+
+  frames = ahead_frames
+  total_time = 0.0
+  state_time = 0.0
+  ahead_time = 0.0
+  count      = 0
+
+# Called after the real frame, run_frame runs one frame. render is
+# whether the frame is to be shown at all (not frame skipped).
+def run(run_frame, render=True):
+  global total_time, state_time, ahead_time, count
+
+  start = time.perf_counter()
+  state = savestate.clone()
+  saved = time.perf_counter()
+
+  for i in range(frames):
+    ppu.render_enabled = render and i == frames - 1
+    run_frame()
+  ahead = time.perf_counter()
+
+  # The frame rendered ahead stays in ppu.frame, the load does not touch it
+  savestate.restore(state)
+  ppu.render_enabled = render
+  end = time.perf_counter()
+
+  state_time += (saved - start) + (end - ahead)
+  ahead_time += ahead - saved
+  total_time += end - start
+  count += 1
+
+# Average milliseconds added to each frame
+def overhead():
+  if not count:
+    return 0.0, 0.0, 0.0
+  return total_time * 1000 / count, state_time * 1000 / count, ahead_time * 1000 / count
@@ -0,0 +1,228 @@
+import os
+import asyncio
+import config
+import ppu
+import pacing
+
+# asyncio Runner
+#
+# Runs the emulator on an asyncio event loop instead of the blocking loop
+# in start_emulator(), so the same thread can serve a control socket.
+# There are no threads and nothing is polled: frames are run in batches
+# and the loop sleeps until the next frame deadline (or, while paused,
+# until a command arrives).
+#
+# Control protocol, one command per line, every command gets one reply
+# line starting with 'ok' or 'error':
+#
+#   pause               stop running frames
+#   resume              run frames again
+#   step [N]            pause and run N frames (1 by default)
+#   screenshot PATH     write the last frame as a PNG
+#   save PATH           write a save state
+#   load PATH           load a save state
+#   rewind [N]          go back N rewind snapshots (1 by default)
+#   status              frame count and whether paused
+#   quit                stop the emulator
+#
+# The address is a Unix socket path, or HOST:PORT for TCP.
+
+# Most frames run back to back when behind, only the last one of a batch
+# is rendered. Above it the deadlines are given up on.
+MAX_BATCH = 4
+
+paused  = False
+running = False
+
+# Frames still to run while paused, from step
+pending_steps = 0
+
+# Frames run
+count = 0
+
+# Set when there is something to run, cleared while paused
+wake = None
+
+# Set when the frames of a step are done
+stepped = None
+
+# Writers of the connected clients, closed when the emulator stops
+clients = set()
+
+# Runs the emulator until quit, the end of a movie, the window is closed
+# or frames frames have run. step runs one frame and returns False at the
+# end, show and poll are the display and keyboard (None when headless).
+def run(address, step, show=None, poll=None, frames=None):
+  return asyncio.run(serve(address, step, show, poll, frames))
+
+async def serve(address, step, show, poll, frames):
+  global running, paused, pending_steps, count, wake, stepped
+
+  running = True
+  paused = False
+  pending_steps = 0
+  count = 0
+  wake = asyncio.Event()
+  wake.set()
+  stepped = asyncio.Event()
+
+  if ':' in address:
+    host, port = address.rsplit(':', 1)
+    server = await asyncio.start_server(handle, host, int(port))
+  else:
+    # A socket file left by an earlier run would make the bind fail
+    if os.path.exists(address):
+      os.unlink(address)
+    server = await asyncio.start_unix_server(handle, address)
+
+  try:
+    await emulate(step, show, poll, frames)
+  finally:
+    server.close()
+    for writer in list(clients):
+      writer.close()
+    await server.wait_closed()
+    if ':' not in address and os.path.exists(address):
+      os.unlink(address)
+
+  return count
+
+async def emulate(step, show, poll, frames):
+  global running, pending_steps, count
+
+  loop = asyncio.get_running_loop()
+  deadline = loop.time()
+
+  while running and count != frames:
+    if poll and not poll():
+      break
+
+    # With a window its events still have to be handled once a frame
+    if paused and not pending_steps:
+      wake.clear()
+      try:
+        await asyncio.wait_for(wake.wait(), 1.0 / config.frame_rate if poll else None)
+      except asyncio.TimeoutError:
+        pass
+      deadline = loop.time()
+      continue
+
+    # Frames due by now, run together without yielding
+    batch = 1
+    if pacing.mode != 'none':
+      period = 1.0 / (config.frame_rate * pacing.speed)
+      late = loop.time() - deadline
+      if late > MAX_BATCH * period:
+        deadline = loop.time()
+      elif late > 0:
+        batch = min(MAX_BATCH, int(late / period) + 1)
+    else:
+      batch = MAX_BATCH
+    if paused:
+      batch = min(batch, pending_steps)
+    if frames is not None:
+      batch = min(batch, frames - count)
+
+    for i in range(batch):
+      ppu.render_enabled = i == batch - 1
+      if not step():
+        running = False
+        break
+      count += 1
+    ppu.render_enabled = True
+
+    if show:
+      show(ppu.frame)
+
+    if paused:
+      pending_steps -= batch
+      if not pending_steps:
+        stepped.set()
+
+    if pacing.mode == 'none':
+      await asyncio.sleep(0)
+    else:
+      deadline += batch * period
+      await asyncio.sleep(max(0.0, deadline - loop.time()))
+
+  running = False
+  stepped.set()
+
+## Control Socket
+
+async def handle(reader, writer):
+  clients.add(writer)
+  try:
+    while running:
+      line = await reader.readline()
+      if not line:
+        break
+
+      # A failing command is reported, the connection stays open
+      try:
+        reply = await command(line.decode().split())
+      except Exception as error:
+        reply = 'error %s' % error
+
+      writer.write((reply + '\n').encode())
+      await writer.drain()
+  except ConnectionError:
+    pass
+  finally:
+    clients.discard(writer)
+    writer.close()
+
+async def command(words):
+  global paused, running, pending_steps
+
+  if not words:
+    return 'error empty command'
+  name, arguments = words[0], words[1:]
+
+  if name == 'pause':
+    paused = True
+  elif name == 'resume':
+    paused = False
+    pending_steps = 0
+    stepped.set()
+    wake.set()
+  elif name == 'step':
+    try:
+      steps = int(arguments[0]) if arguments else 1
+    except ValueError:
+      steps = 0
+    if steps < 1:
+      return 'error step count must be >= 1'
+    # Nothing would ever run the frames
+    if not running:
+      return 'error not running'
+    paused = True
+    pending_steps = steps
+    stepped.clear()
+    wake.set()
+    await stepped.wait()
+  elif name == 'screenshot' and arguments:
+    import export
+    palette = bytes(c for colour in ppu.colour_palette for c in colour)
+    with open(arguments[0], 'wb') as image:
+      image.write(export.png(ppu.frame, palette))
+  elif name == 'save' and arguments:
+    import savestate
+    savestate.save_file(arguments[0])
+  elif name == 'load' and arguments:
+    import savestate
+    savestate.load_file(arguments[0])
+  elif name == 'rewind':
+    import rewind
+    if not rewind.enabled or not rewind.rewind(int(arguments[0]) if arguments else 1):
+      return 'error nothing to rewind'
+    ppu.render_frame()
+  elif name == 'status':
+    return 'ok frame %d %s' % (count, 'paused' if paused else 'running')
+  elif name == 'quit':
+    running = False
+    wake.set()
+  else:
+    return 'error unknown command %s' % ' '.join(words)
+
+  return 'ok'
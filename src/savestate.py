@@ -0,0 +1,312 @@
+import struct
+import zlib
+import loader
+import memory as mem
+import cpu
+import ppu
+import apu
+import input as controller
+import battery
+
+# Save States
+#
+# A save state is the whole machine state in one bytes object, registers
+# and counters packed with struct and memories copied straight from their
+# bytearrays. Saving and loading are a few slices and packs, well under a
+# millisecond, so states can be taken every frame (rewind, run-ahead).
+#
+#   +--------------------+
+#   | Header             | 'NSAV', version, ROM CRC32, sizes
+#   +--------------------+
+#   | CPU                | registers, cycles, frame end, NMI
+#   | CPU memory         | 64KB, the CPU address space is one bytearray
+#   +--------------------+
+#   | PPU                | registers, VRAM address, scroll, timing
+#   | Nametable RAM      | 2KB or 4KB (four screen)
+#   | Palette RAM        | 32 bytes
+#   | OAM                | 256 bytes
+#   | CHR-RAM            | 8KB, only for cartridges without CHR-ROM
+#   +--------------------+
+#   | APU                | channel, DMC, frame counter and output levels
+#   | Controllers        | ports, shift registers, strobe
+#   +--------------------+
+#
+# States are only loaded into the ROM they were saved from. The mapper is
+# NROM, which has no registers, and mirroring comes from the ROM header.
+#
+# clone() takes the same state without serializing it, for branching from
+# one state many times (tree search, run-ahead). Memory is kept in pages
+# of 256 bytes shared between clones: only the pages written since the
+# last clone or restore are copied, the others (PRG-ROM always, most of
+# RAM most of the time) are the same bytes objects as in the clone before.
+#
+#   clone A   [p0 ][p1 ][p2 ][p3 ] ... [p255]
+#                     |    |    |         |
+#   clone B   [p0'][p1'] ---------------------   only p0 and p1 written
+#
+# A clone is a tuple and is only restored into the ROM it was taken from.
+MAGIC   = b'NSAV'
+VERSION = 2
+
+HEADER = struct.Struct('<4sBIHH')
+
+#                    A X Y PC S P cycles frame_end nmi
+CPU = struct.Struct('<BBBHHBqd?')
+
+#                    registers  vram scroll_x/y toggle buffer dot last_sync frames length
+PPU = struct.Struct('<9B        H    HH        B      B      i   q         q      i')
+
+# APU globals in the order they are stored, lists element by element
+APU_FIELDS = [
+  ('enabled', '5?'), ('length', '4i'), ('halt', '4?'),
+  ('envelope_start', '3?'), ('envelope_divider', '3i'), ('envelope_decay', '3i'),
+  ('envelope_constant', '3?'), ('envelope_volume', '3i'),
+  ('pulse_duty', '2i'), ('pulse_period', '2i'), ('pulse_sweep', '2i'),
+  ('sweep_divider', '2i'), ('sweep_reload', '2?'),
+  ('triangle_period', 'i'), ('linear_control', '?'), ('linear_reload', 'i'),
+  ('linear_counter', 'i'), ('linear_flag', '?'),
+  ('noise_mode', 'i'), ('noise_period', 'i'),
+  ('dmc_loop', '?'), ('dmc_rate', 'i'), ('dmc_level', 'i'), ('dmc_address', 'i'),
+  ('dmc_length', 'i'), ('dmc_current', 'i'), ('dmc_remaining', 'i'), ('dmc_shift', 'i'),
+  ('dmc_bits', 'i'), ('dmc_silence', '?'), ('dmc_timer', 'i'),
+  ('phase', '4d'), ('frame_mode', 'i'), ('frame_step', 'i'), ('next_step', 'q'),
+  ('position', 'q'), ('levels', '5i'),
+]
+APU = struct.Struct('<' + ''.join(format for _, format in APU_FIELDS))
+APU_LISTS = [name for name, format in APU_FIELDS if format[0].isdigit()]
+
+# APU globals with the element count of the lists, 0 for plain values
+APU_COUNTS = [(name, int(format[:-1]) if name in APU_LISTS else 0) for name, format in APU_FIELDS]
+
+#                           ports shift strobe
+CONTROLLERS = struct.Struct('<BB   ii    B')
+
+def size(nametable_size, chr_size):
+  return (HEADER.size + CPU.size + 0x10000 + PPU.size + nametable_size
+    + len(ppu.palette_ram) + len(ppu.oam) + chr_size + APU.size + CONTROLLERS.size)
+
+def rom_crc():
+  return zlib.crc32(loader.data)
+
+def save():
+  sync()
+
+  chr_ram = ppu.pattern_tables if ppu.chr_writable else b''
+
+  return b''.join((
+    HEADER.pack(MAGIC, VERSION, rom_crc(), len(ppu.nametable_ram), len(chr_ram)),
+    pack_cpu(),
+    mem.memory,
+    pack_ppu(),
+    ppu.nametable_ram,
+    ppu.palette_ram,
+    ppu.oam,
+    chr_ram,
+    pack_apu(),
+    pack_controllers(),
+  ))
+
+def load(state):
+  view = memoryview(state)
+  if len(view) < HEADER.size:
+    raise ValueError('save state is truncated')
+
+  magic, version, crc, nametable_size, chr_size = HEADER.unpack_from(view)
+  if magic != MAGIC or version != VERSION:
+    raise ValueError('not a version %d save state' % VERSION)
+  if crc != rom_crc():
+    raise ValueError('save state is from another ROM')
+  if nametable_size != len(ppu.nametable_ram) or chr_size != (len(ppu.pattern_tables) if ppu.chr_writable else 0):
+    raise ValueError('save state does not match the cartridge')
+  if len(view) != size(nametable_size, chr_size):
+    raise ValueError('save state has the wrong size')
+  offset = HEADER.size
+
+  unpack_cpu(view, offset)
+  offset += CPU.size
+
+  mem.memory[:] = view[offset:offset + 0x10000]
+  mem.mark_all_dirty()
+  offset += 0x10000
+
+  unpack_ppu(view, offset)
+  offset += PPU.size
+
+  # Only what changes is re-rendered on the canvas
+  ppu.load_nametables(view[offset:offset + nametable_size])
+  offset += nametable_size
+  for memory in (ppu.palette_ram, ppu.oam):
+    memory[:] = view[offset:offset + len(memory)]
+    offset += len(memory)
+  if chr_size:
+    if ppu.pattern_tables != view[offset:offset + chr_size]:
+      ppu.pattern_tables[:] = view[offset:offset + chr_size]
+      ppu.mark_all_dirty()
+    offset += chr_size
+
+  unpack_apu(view, offset)
+  offset += APU.size
+
+  unpack_controllers(view, offset)
+  loaded()
+
+# Register writes the APU and PPU have not applied yet are applied first
+def sync():
+  apu.run_until(cpu.cycles)
+  ppu.catch_up()
+
+# After the machine state is replaced
+def loaded():
+  ppu.schedule()
+  apu.writes = []
+  apu.restart_output()
+  battery.sync()
+
+def pack_cpu():
+  return CPU.pack(cpu.A, cpu.X, cpu.Y, cpu.PC, cpu.S, cpu.P, cpu.cycles, cpu.frame_end, cpu.nmi_pending)
+
+def unpack_cpu(view, offset):
+  (cpu.A, cpu.X, cpu.Y, cpu.PC, cpu.S, cpu.P, cpu.cycles, cpu.frame_end,
+    cpu.nmi_pending) = CPU.unpack_from(view, offset)
+
+def pack_ppu():
+  return PPU.pack(
+    ppu.PPUCTRL, ppu.PPUMASK, ppu.PPUSTATUS, ppu.OAMADDR, ppu.OAMADATA, ppu.PPUSCROLL,
+    ppu.PPUADDR, ppu.PPUDATA, ppu.OAMDMA, ppu.vram_address, ppu.scroll_x, ppu.scroll_y,
+    ppu.write_toggle, ppu.read_buffer, ppu.dot, ppu.last_sync, ppu.frame_count,
+    ppu.frame_length)
+
+# The canvas tiles are drawn from the background pattern table selected
+# by PPUCTRL bit 4, like write_register() a change redraws them all
+def unpack_ppu(view, offset):
+  background = ppu.PPUCTRL & 0b0001_0000
+  (ppu.PPUCTRL, ppu.PPUMASK, ppu.PPUSTATUS, ppu.OAMADDR, ppu.OAMADATA, ppu.PPUSCROLL,
+    ppu.PPUADDR, ppu.PPUDATA, ppu.OAMDMA, ppu.vram_address, ppu.scroll_x, ppu.scroll_y,
+    ppu.write_toggle, ppu.read_buffer, ppu.dot, ppu.last_sync, ppu.frame_count,
+    ppu.frame_length) = PPU.unpack_from(view, offset)
+  if (ppu.PPUCTRL & 0b0001_0000) != background:
+    ppu.mark_all_dirty()
+
+def pack_apu():
+  values = []
+  for name, count in APU_COUNTS:
+    if count:
+      values.extend(getattr(apu, name))
+    else:
+      values.append(getattr(apu, name))
+  return APU.pack(*values)
+
+def unpack_apu(view, offset):
+  values = APU.unpack_from(view, offset)
+  index = 0
+  for name, count in APU_COUNTS:
+    if count:
+      setattr(apu, name, list(values[index:index + count]))
+      index += count
+    else:
+      setattr(apu, name, values[index])
+      index += 1
+
+def pack_controllers():
+  return CONTROLLERS.pack(*controller.ports, *controller.shift, controller.strobe)
+
+def unpack_controllers(view, offset):
+  ports = CONTROLLERS.unpack_from(view, offset)
+  controller.ports[:] = ports[0:2]
+  controller.shift[:] = ports[2:4]
+  controller.strobe = ports[4]
+
+## Clones
+
+# Pages the machine holds unless marked dirty: CPU memory (memory.py
+# tracks its writes), nametables and CHR-RAM (compared, they are small)
+base           = None
+base_nametable = ()
+base_chr       = ()
+
+def clone():
+  global base, base_nametable, base_chr
+
+  sync()
+
+  memory = mem.memory
+  dirty = mem.dirty_pages
+  dirty[1] = 1
+
+  pages = list(base) if base else [None] * 0x100
+  with memoryview(memory) as view:
+    page = dirty.find(1)
+    while page >= 0:
+      start = page * mem.PAGE
+      pages[page] = bytes(view[start:start + mem.PAGE])
+      page = dirty.find(1, page + 1)
+  dirty[:] = bytes(0x100)
+  base = tuple(pages)
+
+  base_nametable = share_pages(ppu.nametable_ram, base_nametable)
+  base_chr = share_pages(ppu.pattern_tables, base_chr) if ppu.chr_writable else ()
+
+  registers = b''.join((pack_cpu(), pack_ppu(), pack_apu(), pack_controllers()))
+  return (loader.data, registers, base, base_nametable, bytes(ppu.palette_ram), bytes(ppu.oam), base_chr)
+
+# Pages of buffer, the ones equal to the page of parent are parent's
+def share_pages(buffer, parent):
+  pages = []
+  with memoryview(buffer) as view:
+    for index, start in enumerate(range(0, len(buffer), mem.PAGE)):
+      page = view[start:start + mem.PAGE]
+      if index < len(parent) and page == parent[index]:
+        pages.append(parent[index])
+      else:
+        pages.append(bytes(page))
+  return tuple(pages)
+
+def restore(clone):
+  global base, base_nametable, base_chr
+
+  data, registers, pages, nametable, palette, oam, chr_pages = clone
+  if data is not loader.data:
+    raise ValueError('clone is from another ROM')
+
+  # Restoring the clone last taken or restored only copies what was
+  # written since, any other copies the whole address space
+  memory = mem.memory
+  dirty = mem.dirty_pages
+  if pages is base:
+    dirty[1] = 1
+    page = dirty.find(1)
+    while page >= 0:
+      start = page * mem.PAGE
+      memory[start:start + mem.PAGE] = pages[page]
+      page = dirty.find(1, page + 1)
+  else:
+    memory[:] = b''.join(pages)
+  dirty[:] = bytes(0x100)
+  base = pages
+
+  # PPU writes are not tracked, these are compared like in load()
+  ppu.load_nametables(b''.join(nametable))
+  base_nametable = nametable
+  ppu.palette_ram[:] = palette
+  ppu.oam[:] = oam
+  if chr_pages:
+    chr_ram = b''.join(chr_pages)
+    if ppu.pattern_tables != chr_ram:
+      ppu.pattern_tables[:] = chr_ram
+      ppu.mark_all_dirty()
+    base_chr = chr_pages
+
+  view = memoryview(registers)
+  unpack_cpu(view, 0)
+  unpack_ppu(view, CPU.size)
+  unpack_apu(view, CPU.size + PPU.size)
+  unpack_controllers(view, CPU.size + PPU.size + APU.size)
+  loaded()
+
+def save_file(path):
+  with open(path, 'wb') as output:
+    output.write(save())
+
+def load_file(path):
+  with open(path, 'rb') as state:
+    load(state.read())
@@ -0,0 +1,62 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+# Integer Scalers
+#
+# All scalers work on 2D arrays (rows, columns) of any dtype, usually the
+# colour indexes of video.indices() or 32-bit mapped pixels. The output can
+# be any writable 2D view, e.g. the transposed pixels2d() of a surface, so
+# the result is written straight into the window.
+
+# Nearest neighbour, every pixel becomes a factor x factor block
+def nearest(frame, factor, out=None):
+  height, width = frame.shape
+
+  if out is None:
+    out = np.empty((height * factor, width * factor), dtype=frame.dtype)
+
+  # out seen as (row, row copy, column, column copy) blocks
+  rows, columns = out.strides
+  blocks = as_strided(out,
+    shape=(height, factor, width, factor),
+    strides=(rows * factor, rows, columns * factor, columns))
+  blocks[...] = frame[:, None, :, None]
+
+  return out
+
+# Scale2x (EPX), doubles the size keeping the edges sharp
+#
+#     A        E0 E1
+#   C P B  ->  E2 E3
+#     D
+#
+# E0 = C if C == A and C != D and A != B else P
+# E1 = A if A == B and A != C and B != D else P
+# E2 = D if D == C and D != B and C != A else P
+# E3 = B if B == D and B != A and D != C else P
+#
+# Pixels outside the frame repeat the edge pixel.
+def scale2x(frame, out=None):
+  height, width = frame.shape
+
+  if out is None:
+    out = np.empty((height * 2, width * 2), dtype=frame.dtype)
+
+  padded = np.pad(frame, 1, mode='edge')
+  p = frame
+  a = padded[:-2, 1:-1]
+  b = padded[1:-1, 2:]
+  c = padded[1:-1, :-2]
+  d = padded[2:, 1:-1]
+
+  ca = c == a
+  ab = a == b
+  dc = d == c
+  bd = b == d
+
+  out[0::2, 0::2] = np.where(ca & ~dc & ~ab, c, p)
+  out[0::2, 1::2] = np.where(ab & ~ca & ~bd, a, p)
+  out[1::2, 0::2] = np.where(dc & ~bd & ~ca, d, p)
+  out[1::2, 1::2] = np.where(bd & ~ab & ~dc, b, p)
+
+  return out
@@ -0,0 +1,222 @@
+import struct
+from multiprocessing import shared_memory, resource_tracker
+
+# Shared Frame and Audio Buffers
+#
+# With the core in its own process (main.py --split) finished frames and
+# samples are handed over in one shared memory block. The core is the
+# only writer, the front-end (or any other process that attaches, like an
+# encoder) reads. Counters only grow and are published after the data
+# they cover is in place, so no lock is needed.
+#
+#  +--------+ 0
+#  | Header |  magic, version, frame slots, audio capacity, counters
+#  +--------+ 64
+#  | Frames |  slots x 256x240 colour indexes, frame n is in slot n % slots
+#  +--------+
+#  | Audio  |  16-bit signed samples, sample n is at n % capacity
+#  +--------+
+#
+#  Header
+#
+#  +----+----------------+-------------------------------------------+
+#  |  0 | magic, version | 'NESS', 1                                 |
+#  |  5 | slots          | frame slots                               |
+#  |  8 | frame_sequence | frames written                            |
+#  | 16 | audio_write    | samples written                           |
+#  | 24 | audio_read     | samples read by the front-end             |
+#  | 32 | ports          | controller state, from the front-end      |
+#  | 34 | state          | RUNNING, STOPPING (front-end) or FINISHED |
+#  | 36 | capacity       | audio samples                             |
+#  | 40 | device_fill    | samples queued in the front-end, pacing   |
+#  +----+----------------+-------------------------------------------+
+#
+# A frame slot is only rewritten slots - 1 frames later, a reader that is
+# lapped while copying sees it from frame_sequence and copies again.
+MAGIC   = b'NESS'
+VERSION = 1
+
+HEADER_SIZE = 64
+FRAME_SIZE  = 256 * 240
+
+# 64-bit counters, index in the header as an array of 'Q'
+FRAME_SEQUENCE = 1
+AUDIO_WRITE    = 2
+AUDIO_READ     = 3
+DEVICE_FILL    = 5
+
+PORTS = 32
+STATE = 34
+
+RUNNING  = 0
+STOPPING = 1
+FINISHED = 2
+
+memory   = None
+views    = []
+counters = None
+frames   = None
+samples  = None
+slots    = 0
+capacity = 0
+
+# Set in the process that attached (or created) the block
+attached = False
+
+# Samples dropped because the front-end did not keep up
+overruns = 0
+
+def create(frame_slots=3, audio_capacity=22050, name=None):
+  global memory
+
+  size = HEADER_SIZE + frame_slots * FRAME_SIZE + audio_capacity * 2
+  memory = shared_memory.SharedMemory(name, create=True, size=size)
+  memory.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+  struct.pack_into('<4sBB', memory.buf, 0, MAGIC, VERSION, frame_slots)
+  struct.pack_into('<I', memory.buf, 36, audio_capacity)
+
+  map_views()
+  return memory.name
+
+# child is set in processes started by the creator with multiprocessing,
+# they share its resource tracker
+def attach(name, child=False):
+  global memory
+
+  # A forked child inherits the creator's mapping
+  close()
+  memory = shared_memory.SharedMemory(name)
+
+  # Only the creator unlinks the block, the resource tracker of any other
+  # process would unlink it (and warn) when that process exits
+  if not child:
+    resource_tracker.unregister(memory._name, 'shared_memory')
+
+  magic, version, _ = struct.unpack_from('<4sBB', memory.buf, 0)
+  if magic != MAGIC or version != VERSION:
+    raise ValueError('%s is not a version %d frame buffer' % (name, VERSION))
+
+  map_views()
+
+def map_views():
+  global views, counters, frames, samples, slots, capacity, attached, overruns
+
+  slots = memory.buf[5]
+  capacity = struct.unpack_from('<I', memory.buf, 36)[0]
+
+  header = memory.buf[:HEADER_SIZE]
+  audio = memory.buf[HEADER_SIZE + slots * FRAME_SIZE:]
+
+  counters = header.cast('Q')
+  frames = memory.buf[HEADER_SIZE:HEADER_SIZE + slots * FRAME_SIZE]
+  samples = audio.cast('h')
+
+  # Released by close(), casts before the views they were made from
+  views = [counters, samples, header, audio, frames]
+
+  attached = True
+  overruns = 0
+
+def close(unlink=False):
+  global memory, views, counters, frames, samples, attached
+
+  if memory is None:
+    return
+
+  # The views must be released before the block can be closed
+  for view in views:
+    view.release()
+  views = []
+  counters = frames = samples = None
+
+  memory.close()
+  if unlink:
+    memory.unlink()
+
+  memory = None
+  attached = False
+
+## Frames
+
+def write_frame(frame):
+  sequence = counters[FRAME_SEQUENCE]
+  start = (sequence % slots) * FRAME_SIZE
+  frames[start:start + FRAME_SIZE] = frame
+
+  counters[FRAME_SEQUENCE] = sequence + 1
+
+def frame_sequence():
+  return counters[FRAME_SEQUENCE]
+
+# Copy of the newest frame and its sequence number, None before the first
+def read_frame():
+  while True:
+    sequence = counters[FRAME_SEQUENCE]
+    if not sequence:
+      return None, 0
+
+    start = ((sequence - 1) % slots) * FRAME_SIZE
+    frame = bytearray(frames[start:start + FRAME_SIZE])
+
+    # The core may have moved on, but not onto this slot
+    if counters[FRAME_SEQUENCE] - sequence < slots - 1:
+      return frame, sequence
+
+## Audio
+
+def write_audio(values):
+  global overruns
+
+  write_index = counters[AUDIO_WRITE]
+  free = capacity - (write_index - counters[AUDIO_READ])
+  count = len(values)
+  if count > free:
+    overruns += count - free
+    count = free
+
+  values = memoryview(values).cast('B').cast('h')[:count]
+  start = write_index % capacity
+  first = min(count, capacity - start)
+  samples[start:start + first] = values[:first]
+  samples[:count - first] = values[first:]
+
+  counters[AUDIO_WRITE] = write_index + count
+
+# Samples written since the last call, as a 'h' memoryview
+def read_audio():
+  read_index = counters[AUDIO_READ]
+  count = counters[AUDIO_WRITE] - read_index
+
+  start = read_index % capacity
+  first = min(count, capacity - start)
+  values = bytearray(samples[start:start + first]) + bytearray(samples[:count - first])
+
+  counters[AUDIO_READ] = read_index + count
+  return memoryview(values).cast('h')
+
+# Samples written and not read yet
+def audio_fill():
+  return counters[AUDIO_WRITE] - counters[AUDIO_READ]
+
+# Samples waiting to be played, in shared memory and in the front-end's
+# own buffer. The core paces itself from it like from audio.fill().
+def set_device_fill(count):
+  counters[DEVICE_FILL] = count
+
+def device_fill():
+  return counters[DEVICE_FILL] + audio_fill()
+
+## Control
+
+def write_ports(ports):
+  memory.buf[PORTS] = ports[0]
+  memory.buf[PORTS + 1] = ports[1]
+
+def read_ports():
+  return memory.buf[PORTS], memory.buf[PORTS + 1]
+
+def set_state(value):
+  memory.buf[STATE] = value
+
+def state():
+  return memory.buf[STATE]
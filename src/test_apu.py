@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import apu
+import savestate
+import runahead
+import cpu
+
+@pytest.fixture
+def synthesizing(machine):
+  apu.synthesize = True
+  apu.load_numpy()
+  apu.initialize()
+  yield machine
+  apu.synthesize = False
+
+# Where the running sum of the output ends, against the mix of the levels
+def offset():
+  return apu.integrator + apu.blip_tail.sum() - apu.mix(apu.levels)
+
+def test_loads_do_not_leave_an_offset(synthesizing):
+  states = []
+  for frame in range(120):
+    synthesizing.next_frame()
+    if frame % 7 == 0:
+      states.append(savestate.save())
+    if frame % 13 == 12:
+      savestate.load(states[len(states) // 2])
+      synthesizing.next_frame()
+      assert abs(offset()) < 1e-9
+
+def test_run_ahead_does_not_drift(synthesizing):
+  runahead.initialize(2)
+  for _ in range(60):
+    synthesizing.next_frame()
+
+  assert abs(offset()) < 1e-9
+
+def test_output_is_clipped(synthesizing):
+  apu.integrator = 0.99
+  apu.delta_cycles = [np.array([float(cpu.cycles)])]
+  apu.delta_values = [np.array([0.5])]
+  synthesizing.run_frame()
+
+  samples = apu.end_frame()
+  assert samples.min() >= 0
+  assert samples[-1] == 32767
+
+# Headless runs never load NumPy, the noise phase still advances
+def test_headless_noise(machine, monkeypatch):
+  import memory as mem
+  monkeypatch.setattr(apu, 'np', None)
+  apu.synthesize = False
+  machine.next_frame()
+
+  mem.write(0x4015, 0x09)
+  mem.write(0x400E, 0x80)
+  mem.write(0x400F, 0x08)
+  for _ in range(5):
+    machine.next_frame()
+
+  assert apu.length[apu.NOISE] and 0 <= apu.phase[apu.NOISE] < apu.NOISE_LENGTHS[1]
@@ -0,0 +1,24 @@
+import pytest
+import audio
+
+sdl = pytest.importorskip('pygame._sdl2.sdl2')
+sdl_audio = pytest.importorskip('pygame._sdl2.audio')
+
+def test_no_output_device_runs_silent(monkeypatch):
+  monkeypatch.setattr(sdl, 'init_subsystem', lambda flags: None)
+  monkeypatch.setattr(sdl_audio, 'get_audio_device_names', lambda capture: [])
+
+  assert audio.initialize(44100) is False
+  assert audio.device is None
+
+  audio.write(audio.np.arange(100, dtype=audio.np.int16))
+  assert audio.fill() == 100
+  audio.close()
+
+def test_no_audio_driver_runs_silent(monkeypatch):
+  def fail(flags):
+    raise sdl.error('dsp: No such audio device')
+  monkeypatch.setattr(sdl, 'init_subsystem', fail)
+
+  assert audio.initialize(44100) is False
+  audio.close()
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import ppu
+import memory as mem
+import input as controller
+from batch import BatchEmulator
+
+FRAMES = 12
+
+# Buttons of instance on a frame, A on and off at its own rhythm so the
+# instances use different background pattern tables on the same frame
+def buttons(instance, frame):
+  return 0x01 if (frame // (instance + 1)) % 2 else 0x00
+
+# Frames and RAM of a plain run of one instance
+def plain_run(machine, rom, instance, frames):
+  machine.initialize(rom, headless_mode=True)
+  for frame in range(frames):
+    controller.ports[0] = buttons(instance, frame)
+    machine.next_frame()
+  return bytes(ppu.frame), bytes(mem.memory[:0x800])
+
+@pytest.fixture
+def env(rom):
+  # Two instances per worker, so workers switch between them
+  env = BatchEmulator(4, rom, processes=2)
+  yield env
+  env.close()
+
+def step(env, frames):
+  for frame in range(frames):
+    result = env.step(np.array([buttons(instance, frame) for instance in range(env.n)], np.uint8))
+  return result
+
+def test_diverging_instances_match_plain_runs(env, machine, rom):
+  frames, ram = step(env, FRAMES)
+
+  assert frames.shape == (4, 240, 256) and ram.shape == (4, 0x800)
+  for instance in range(4):
+    frame, memory = plain_run(machine, rom, instance, FRAMES)
+    assert frames[instance].tobytes() == frame
+    assert ram[instance].tobytes() == memory
+  assert len({frames[instance].tobytes() for instance in range(4)}) > 1
+
+def test_reset_of_a_subset(env, machine, rom):
+  step(env, FRAMES)
+  start_frames, start_ram = (array.copy() for array in env.reset([1, 2]))
+  assert (start_ram[1] == 0).all() and (start_ram[2] == 0).all()
+
+  # Reset instances start over, the others go on from where they were
+  frames, ram = step(env, 5)
+  for instance in range(4):
+    if instance in (1, 2):
+      frame, memory = plain_run(machine, rom, instance, 5)
+      assert frames[instance].tobytes() == frame
+      assert ram[instance].tobytes() == memory
+    else:
+      assert ram[instance][0] == FRAMES + 5
+
+def test_worker_errors_are_raised(rom, tmp_path):
+  with pytest.raises(ValueError):
+    BatchEmulator(2, str(tmp_path / 'missing.nes'))
@@ -0,0 +1,55 @@
+import pytest
+import loader
+import movie
+import input as controller
+
+@pytest.fixture(autouse=True)
+def rom(monkeypatch):
+  monkeypatch.setattr(loader, 'data', b'NES\x1a test rom')
+  controller.initialize(False)
+  yield
+  movie.mode = None
+
+def record(path, frames):
+  movie.start_recording(path)
+  for ports in frames:
+    movie.record(ports)
+  movie.stop()
+
+def play(path):
+  movie.start_playback(path)
+  frames = []
+  while movie.play():
+    frames.append(tuple(controller.ports))
+  return frames
+
+def test_round_trip(tmp_path):
+  path = str(tmp_path / 'run.nesm')
+  frames = [(0, 0)] * 10 + [(0x01, 0)] * 3 + [(0x81, 0x10)] + [(0, 0)] * 5
+  record(path, frames)
+
+  assert play(path) == frames
+  assert movie.frame == len(frames)
+
+def test_runs_are_encoded():
+  movie.start_recording(None)
+  for ports in [(0, 0)] * 4 + [(1, 2)] * 2 + [(0, 0)]:
+    movie.record(ports)
+
+  assert movie.runs == [[4, 0, 0], [2, 1, 2], [1, 0, 0]]
+
+def test_long_run_is_split(tmp_path):
+  path = str(tmp_path / 'long.nesm')
+  frames = [(0, 0)] * (movie.MAX_RUN + 5)
+  record(path, frames)
+
+  assert [run[0] for run in movie.runs] == [movie.MAX_RUN, 5]
+  assert len(play(path)) == len(frames)
+
+def test_other_rom_is_refused(tmp_path, monkeypatch):
+  path = str(tmp_path / 'run.nesm')
+  record(path, [(0, 0)])
+
+  monkeypatch.setattr(loader, 'data', b'another rom')
+  with pytest.raises(ValueError):
+    movie.start_playback(path)
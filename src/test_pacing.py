@@ -0,0 +1,58 @@
+import pytest
+import config
+import pacing
+
+# Wall clock that only moves when the emulator works or sleeps
+class Clock:
+  def __init__(self):
+    self.now = 100.0
+
+  def perf_counter(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.now += max(seconds, 1e-5)
+
+@pytest.fixture
+def clock(monkeypatch):
+  clock = Clock()
+  monkeypatch.setattr(pacing, 'time', clock)
+  config.set_region(config.NTSC)
+  return clock
+
+# Runs frames taking frame_time (skipped_time when skipped) on the wall
+# pacer, returns the skip decision of each
+def run(clock, frames, frame_time, skipped_time=None, max_skip=3):
+  pacing.initialize('wall', max_frame_skip=max_skip)
+  skips = []
+  for _ in range(frames):
+    skip = pacing.should_skip()
+    skips.append(skip)
+    clock.now += skipped_time if skip and skipped_time is not None else frame_time
+    pacing.wait()
+  return skips
+
+def test_fast_frames_are_not_skipped(clock):
+  assert not any(run(clock, 60, 0.002))
+
+def test_frames_just_within_budget_are_not_skipped(clock):
+  assert not any(run(clock, 60, 0.9 / config.frame_rate))
+
+def test_slow_frames_are_skipped(clock):
+  skips = run(clock, 60, 0.025, skipped_time=0.005)
+
+  assert any(skips)
+  assert not all(skips)
+
+def test_skips_in_a_row_are_limited(clock):
+  skips = run(clock, 60, 0.1, max_skip=2)
+
+  longest = run_length = 0
+  for skip in skips:
+    run_length = run_length + 1 if skip else 0
+    longest = max(longest, run_length)
+  assert longest == 2
+
+def test_unpaced_never_skips(clock):
+  pacing.initialize('none')
+  assert not pacing.should_skip()
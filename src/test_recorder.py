@@ -0,0 +1,35 @@
+import os
+import threading
+import pytest
+import recorder
+
+def frame(value):
+  return bytes([value]) * (recorder.WIDTH * recorder.HEIGHT)
+
+def test_nesv_round_trip(tmp_path):
+  path = str(tmp_path / 'run.nesv')
+  recorder.start(path, max_frames=10)
+  for value in range(5):
+    recorder.push(frame(value))
+  recorder.stop()
+
+  assert recorder.error is None
+  assert recorder.written + recorder.dropped == 5
+  assert list(recorder.read_nesv(path))[0] == frame(0)
+
+@pytest.mark.skipif(not os.path.exists('/dev/full'), reason='needs /dev/full')
+def test_stop_returns_when_the_writer_died(capsys):
+  # Every write to /dev/full fails with ENOSPC, like a full disk
+  recorder.start('/dev/full', max_frames=2)
+  noise = os.urandom(recorder.WIDTH * recorder.HEIGHT)
+  for _ in range(50):
+    recorder.push(noise)
+  recorder.worker.join(5)
+
+  stopper = threading.Thread(target=recorder.stop)
+  stopper.start()
+  stopper.join(5)
+
+  assert not stopper.is_alive()
+  assert isinstance(recorder.error, OSError)
+  assert 'recording stopped' in capsys.readouterr().err
@@ -0,0 +1,55 @@
+import zlib
+import rewind
+import savestate
+import memory as mem
+
+def test_xor_is_its_own_inverse():
+  a = bytes(range(256)) * 4
+  b = bytes(reversed(range(256))) * 4
+  delta = rewind.xor(a, b)
+
+  assert len(delta) == len(a)
+  assert rewind.xor(delta, b) == a
+  assert rewind.xor(a, a) == bytes(len(a))
+
+# next_frame() pushes while rewind is enabled
+def test_snapshots_are_deltas_of_the_keyframe(machine):
+  rewind.initialize(snapshot_interval=1, keyframe_interval=4)
+  for _ in range(6):
+    machine.next_frame()
+
+  assert [len(group) for group in rewind.groups] == [4, 2]
+  # A delta of nearby frames is mostly zeros
+  group = rewind.groups[0]
+  assert len(group[1]) < len(group[0])
+  keyframe = zlib.decompress(group[0])
+  savestate.load(rewind.xor(zlib.decompress(group[1]), keyframe))
+  assert mem.memory[0x00] == 2
+
+def test_rewind_goes_back(machine):
+  rewind.initialize(snapshot_interval=2, keyframe_interval=3)
+  states = []
+  for _ in range(10):
+    machine.next_frame()
+    if rewind.frames == 0:
+      states.append(savestate.save())
+
+  assert rewind.count() == 5
+  assert rewind.rewind(2)
+  assert savestate.save() == states[2]
+  assert rewind.count() == 3
+
+  # The oldest snapshot stays
+  assert rewind.rewind(10)
+  assert savestate.save() == states[0]
+  assert mem.memory[0x00] == 2
+
+def test_eviction_keeps_the_budget(machine):
+  rewind.initialize(snapshot_interval=1, budget_mb=0, keyframe_interval=2)
+  for _ in range(8):
+    machine.next_frame()
+
+  # Only the newest group is left
+  assert len(rewind.groups) == 1
+  assert rewind.evicted + rewind.count() == 8
+  assert rewind.size == sum(len(entry) for entry in rewind.groups[0])
@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+import pacing
+import rewind
+import runner
+
+@pytest.fixture(autouse=True)
+def unpaced(monkeypatch):
+  monkeypatch.setattr(pacing, 'mode', 'none')
+  monkeypatch.setattr(rewind, 'enabled', False)
+
+# Runs the runner on a socket with a step function that never ends,
+# sends the commands one by one and returns the replies
+def session(tmp_path, *commands):
+  address = str(tmp_path / 'nes.sock')
+
+  async def client():
+    task = asyncio.ensure_future(runner.serve(address, lambda: True, None, None, None))
+    while not runner.running or not (tmp_path / 'nes.sock').exists():
+      await asyncio.sleep(0)
+
+    reader, writer = await asyncio.open_unix_connection(address)
+    replies = []
+    for command in commands:
+      writer.write((command + '\n').encode())
+      await writer.drain()
+      replies.append((await asyncio.wait_for(reader.readline(), 5)).decode().strip())
+    writer.close()
+
+    runner.running = False
+    runner.wake.set()
+    await asyncio.wait_for(task, 5)
+    return replies
+
+  return asyncio.run(client())
+
+def test_pause_step_status(tmp_path):
+  replies = session(tmp_path, 'pause', 'step 3', 'status', 'step', 'status')
+
+  assert replies[:2] == ['ok', 'ok']
+  count = int(replies[2].split()[2])
+  assert replies[2] == 'ok frame %d paused' % count
+  assert replies[4] == 'ok frame %d paused' % (count + 1)
+
+def test_step_count_is_validated(tmp_path):
+  replies = session(tmp_path, 'step 0', 'step -2', 'step two', 'status')
+
+  assert replies[:3] == ['error step count must be >= 1'] * 3
+  assert replies[3].startswith('ok frame')
+
+def test_unknown_commands_and_missing_arguments(tmp_path):
+  replies = session(tmp_path, 'jump', 'save', 'rewind')
+
+  assert replies[0] == 'error unknown command jump'
+  assert replies[1] == 'error unknown command save'
+  assert replies[2] == 'error nothing to rewind'
+
+def test_step_after_the_end(monkeypatch):
+  monkeypatch.setattr(runner, 'running', False)
+
+  assert asyncio.run(runner.command(['step'])) == 'error not running'
+
+def test_load_of_a_truncated_state(tmp_path, machine):
+  import savestate
+  path = tmp_path / 'state'
+  path.write_bytes(savestate.save()[:-10])
+  short = tmp_path / 'short'
+  short.write_bytes(b'NSAV')
+
+  replies = session(tmp_path, 'load %s' % path, 'load %s' % short, 'status')
+
+  assert replies[0].startswith('error') and replies[1].startswith('error')
+  assert replies[2].startswith('ok frame')
@@ -0,0 +1,135 @@
+import pytest
+import savestate
+import memory as mem
+import apu
+import ppu
+import input as controller
+
+def run(machine, frames, buttons=0):
+  controller.ports[0] = buttons
+  for _ in range(frames):
+    machine.next_frame()
+
+def test_save_load_round_trip(machine):
+  run(machine, 20)
+  state = savestate.save()
+  run(machine, 7, buttons=0x01)
+  after = savestate.save()
+
+  savestate.load(state)
+  assert savestate.save() == state
+
+  run(machine, 7, buttons=0x01)
+  assert savestate.save() == after
+
+def test_file_round_trip(machine, tmp_path):
+  run(machine, 5)
+  path = str(tmp_path / 'state.nsav')
+  savestate.save_file(path)
+  state = savestate.save()
+  run(machine, 5)
+
+  savestate.load_file(path)
+  assert savestate.save() == state
+  assert mem.memory[0x00] == 5
+
+def test_apu_output_levels_are_saved(machine):
+  apu.levels[:] = [15, 7, 3, 1, 64]
+  state = savestate.save()
+  apu.levels[:] = [0] * 5
+
+  savestate.load(state)
+  assert apu.levels == [15, 7, 3, 1, 64]
+
+def test_bad_states_are_refused(machine):
+  state = bytearray(savestate.save())
+
+  with pytest.raises(ValueError):
+    savestate.load(b'XXXX' + state[4:])
+
+  # Version byte
+  state[4] = savestate.VERSION + 1
+  with pytest.raises(ValueError):
+    savestate.load(state)
+
+  state[4] = savestate.VERSION
+  state[5] ^= 0xFF
+  with pytest.raises(ValueError):
+    savestate.load(state)
+  state[5] ^= 0xFF
+
+  # Truncated, nothing is written
+  memory = bytes(mem.memory)
+  for length in (len(state) - 1, 0x100, 5):
+    with pytest.raises(ValueError):
+      savestate.load(state[:length])
+    assert len(mem.memory) == 0x10000 and mem.memory == memory
+  savestate.load(state)
+
+def test_load_redraws_for_the_pattern_table(machine):
+  run(machine, 10)
+  state = savestate.save()
+  ppu.render_frame()
+  frame = bytes(ppu.frame)
+
+  # The other background pattern table draws other tiles
+  ppu.write_register(0x0, ppu.PPUCTRL ^ 0b0001_0000)
+  ppu.render_frame()
+  assert bytes(ppu.frame) != frame
+
+  savestate.load(state)
+  ppu.render_frame()
+  assert bytes(ppu.frame) == frame
+
+## Clones
+
+def test_clone_restore_round_trip(machine):
+  run(machine, 10)
+  clone = savestate.clone()
+  state = savestate.save()
+  run(machine, 5, buttons=0x01)
+  after = savestate.save()
+
+  savestate.restore(clone)
+  assert savestate.save() == state
+  run(machine, 5, buttons=0x01)
+  assert savestate.save() == after
+
+  # Restoring the same clone again only copies what was written since
+  savestate.restore(clone)
+  savestate.restore(clone)
+  assert savestate.save() == state
+
+def test_clones_share_unwritten_pages(machine):
+  run(machine, 10)
+  parent = savestate.clone()
+  run(machine, 1)
+  child = savestate.clone()
+
+  pages = child[2]
+  shared = sum(page is parent_page for page, parent_page in zip(pages, parent[2]))
+  assert shared >= 250
+  # PRG-ROM is never written
+  assert all(pages[page] is parent[2][page] for page in range(0xC0, 0x100))
+
+def test_restore_redraws_for_the_pattern_table(machine):
+  run(machine, 10)
+  plain = savestate.clone()
+  ppu.render_frame()
+  frame = bytes(ppu.frame)
+
+  run(machine, 2, buttons=0x01)
+  assert ppu.PPUCTRL & 0b0001_0000
+  other = bytes(ppu.frame)
+  assert other != frame
+
+  savestate.restore(plain)
+  ppu.render_frame()
+  assert bytes(ppu.frame) == frame
+
+def test_restore_refuses_other_roms(machine, monkeypatch):
+  clone = savestate.clone()
+  monkeypatch.setattr(machine.loader, 'data', b'another rom')
+
+  with pytest.raises(ValueError):
+    savestate.restore(clone)
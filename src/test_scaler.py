@@ -0,0 +1,37 @@
+import numpy as np
+import scaler
+
+def test_nearest_blocks():
+  frame = np.array([[1, 2], [3, 4]], dtype=np.uint8)
+  out = scaler.nearest(frame, 3)
+
+  assert out.shape == (6, 6)
+  assert (out == np.kron(frame, np.ones((3, 3), dtype=np.uint8))).all()
+
+def test_nearest_into_transposed_view():
+  frame = np.arange(6, dtype=np.uint32).reshape(2, 3)
+  surface = np.zeros((6, 4), dtype=np.uint32)
+
+  scaler.nearest(frame, 2, surface.T)
+
+  assert (surface.T == scaler.nearest(frame, 2)).all()
+
+def test_scale2x_flat_and_single_pixel():
+  # A flat area stays flat, a lone pixel becomes a 2x2 block
+  frame = np.zeros((3, 3), dtype=np.uint8)
+  frame[1, 1] = 5
+  out = scaler.scale2x(frame)
+
+  expected = np.zeros((6, 6), dtype=np.uint8)
+  expected[2:4, 2:4] = 5
+  assert (out == expected).all()
+
+def test_scale2x_diagonal_edge():
+  # Below the diagonal is 1, E2 of the centre pixel takes its colour
+  frame = np.array([
+    [0, 0, 0],
+    [1, 0, 0],
+    [1, 1, 0]], dtype=np.uint8)
+  out = scaler.scale2x(frame)
+
+  assert (out[2:4, 2:4] == [[0, 0], [1, 0]]).all()
@@ -0,0 +1,71 @@
+import array
+import pytest
+import shared
+
+@pytest.fixture
+def block():
+  name = shared.create(frame_slots=3, audio_capacity=8)
+  yield name
+  if shared.memory is None:
+    shared.attach(name, child=True)
+  shared.close(unlink=True)
+
+def samples(*values):
+  return array.array('h', values)
+
+def test_audio_wraps_around(block):
+  shared.write_audio(samples(1, 2, 3, 4, 5, 6))
+  assert list(shared.read_audio()) == [1, 2, 3, 4, 5, 6]
+
+  # Starts at 6 of 8 and wraps to the start of the ring
+  shared.write_audio(samples(7, 8, 9, 10))
+  assert shared.audio_fill() == 4
+  assert list(shared.read_audio()) == [7, 8, 9, 10]
+  assert shared.audio_fill() == 0
+
+def test_audio_overrun_drops_the_excess(block):
+  shared.write_audio(samples(*range(10)))
+
+  assert shared.overruns == 2
+  assert list(shared.read_audio()) == list(range(8))
+
+def test_device_fill_counts_unread_samples(block):
+  shared.set_device_fill(100)
+  shared.write_audio(samples(1, 2, 3))
+
+  assert shared.device_fill() == 103
+
+def test_frames_and_sequence(block):
+  assert shared.read_frame() == (None, 0)
+
+  for value in range(5):
+    shared.write_frame(bytes([value]) * shared.FRAME_SIZE)
+
+  frame, sequence = shared.read_frame()
+  assert sequence == 5 == shared.frame_sequence()
+  assert frame == bytes([4]) * shared.FRAME_SIZE
+
+def test_ports_and_state(block):
+  shared.write_ports([0x81, 0x10])
+  shared.set_state(shared.STOPPING)
+
+  assert shared.read_ports() == (0x81, 0x10)
+  assert shared.state() == shared.STOPPING
+
+def test_attach_by_name(block):
+  shared.write_frame(bytes([7]) * shared.FRAME_SIZE)
+  shared.close()
+
+  shared.attach(block, child=True)
+  assert shared.read_frame() == (bytes([7]) * shared.FRAME_SIZE, 1)
+
+def test_attach_refuses_other_blocks():
+  from multiprocessing import shared_memory
+  other = shared_memory.SharedMemory(create=True, size=shared.HEADER_SIZE)
+  try:
+    with pytest.raises(ValueError):
+      shared.attach(other.name, child=True)
+  finally:
+    shared.close()
+    other.close()
+    other.unlink()
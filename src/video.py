@@ -0,0 +1,24 @@
+import numpy as np
+import ppu
+
+# Frame conversion
+#
+# ppu.frame holds one colour index (0x00-0x3F) per pixel. The PPU builds a
+# new frame buffer every frame and never writes to a finished one, so the
+# arrays returned by indices() can share its memory.
+
+# ppu.colour_palette as a 64x3 uint8 array, built on first use
+rgb_palette = None
+
+# 240x256 uint8 array of colour indexes of a frame, the last one by default
+def indices(frame=None):
+  return np.frombuffer(ppu.frame if frame is None else frame, dtype=np.uint8).reshape(240, 256)
+
+# 240x256x3 uint8 array of RGB colours of a frame, the last one by default
+def rgb(frame=None):
+  global rgb_palette
+
+  if rgb_palette is None:
+    rgb_palette = np.array(ppu.colour_palette, dtype=np.uint8)
+
+  return rgb_palette[indices(frame)]